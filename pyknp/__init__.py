@@ -4,7 +4,7 @@ __version__ = pkg_resources.get_distribution('pyknp').version
 from .utils.process import Socket, Subprocess
 from .juman.morpheme import JUMAN_FORMAT, Morpheme
 from .juman.mlist import MList
-from .juman.juman import Juman
+from .juman.juman import AsyncJuman, Juman
 from .knp.rel import Rel
 from .knp.pas import Argument, Pas
 from .knp.features import Features
@@ -14,6 +14,6 @@ from .knp.tlist import TList
 from .knp.bunsetsu import Bunsetsu
 from .knp.syngraph import SynNodes, SynNode
 from .knp.blist import BList
-from .knp.knp import KNP
+from .knp.knp import AsyncKNP, KNP
 import pyknp.evaluate
 import pyknp.utils
@@ -11,7 +11,10 @@ import unittest
 
 import six
 
-from pyknp.utils.analyzer import Analyzer
+from pyknp.utils.analyzer import Analyzer, AnalyzerPool, Quarantine
+from pyknp.utils.cache import AnalysisCache
+from pyknp.utils.normalizer import Normalizer, normalize
+from pyknp.utils.process import AsyncSubprocess, to_aiter
 from .mlist import MList
 from .morpheme import JUMAN_FORMAT
 
@@ -25,6 +28,28 @@ class Juman(object):
         rcfile (str): JUMAN設定ファイルへのパス
         pattern (str): JUMAN出力の終端記号
         jumanpp (bool): JUMAN++を用いるかJUMANを用いるか。commandを指定した場合は無視される。
+        multithreading (bool): 解析をメインスレッド以外から行う可能性があるか
+        workers (int): 並列に起動するJUMANプロセスの数 (2以上の場合はスレッドセーフ)
+        spares (int): 異常終了したプロセスと入れ替えるために予め起動しておく予備のJUMANプロセスの数
+        daemon (str): pyknp-server のUnixドメインソケットのパス。指定した場合はプロセスを起動せず pyknp-server に解析を依頼する
+        connections (int): サーバーモードで張る接続の数 (2以上の場合はスレッドセーフ)。
+                           server に '/' を含むパスを指定した場合はUnixドメインソケットで接続する
+        max_queue (int): 解析待ちの要求数の上限。指定した場合、上限を超えた要求は待たずに OverloadedError を送出する
+        max_requests (int): 1つのプロセスで解析する文数の上限。達したプロセスは新しいものと入れ替える
+        max_rss (int): プロセスの常駐メモリ (RSS, バイト) の上限。/proc から読み、超えたプロセスは新しいものと入れ替える
+        memory_limit (int): 起動するプロセスに設定するアドレス空間の上限 (RLIMIT_AS, バイト)
+        cpus (list): 各プロセスを固定するCPUコア (コア番号またはコア番号の集合) のリスト。i 番目のプロセスは cpus[i % len(cpus)] に固定される
+        nice (int): 起動するプロセスのnice値
+        ionice (tuple): 起動するプロセスのI/Oスケジューリングクラスとクラス内の優先度の組 (例: (3, None))
+        quarantine (Quarantine): 1文あたりのタイムアウトを超えた文を記録する先 (True の場合は新たに作る)。
+                                 記録された文は再び解析せず、QuarantinedError を送出する
+        coalesce (bool): 解析中の文と同じ文が解析を依頼された場合、解析し直さずに解析中の結果を待って使うか
+        cache (AnalysisCache): 解析結果を記憶する先 (True の場合は新たに作る)。
+                               DiskCache を指定すると、ファイルに記憶して複数のプロセスで共有する。
+                               記憶している文は解析せず、記憶している結果から新たに MList を作る。
+                               コマンド・オプション・設定ファイルごとに区別して記憶するため、複数の Juman/KNP で共有できる
+        normalizer (Normalizer): JUMANに渡す前 (cache を引く前) に入力文字列を正規化する関数 (True の場合は Normalizer())。
+                                 analysis関数などの結果の normalized 属性に、正規化した文字列と元の文字列での位置が入る
     """
 
     def __init__(self,
@@ -38,6 +63,21 @@ class Juman(object):
                  pattern=r'^EOS$',
                  jumanpp=True,
                  multithreading=False,
+                 workers=1,
+                 spares=0,
+                 daemon=None,
+                 connections=1,
+                 max_queue=None,
+                 max_requests=None,
+                 max_rss=None,
+                 memory_limit=None,
+                 cpus=None,
+                 nice=None,
+                 ionice=None,
+                 quarantine=None,
+                 coalesce=False,
+                 cache=None,
+                 normalizer=None,
                  ):
         if jumanpp or command != 'jumanpp':
             self.command = command
@@ -51,51 +91,145 @@ class Juman(object):
         self.rcfile = rcfile
         self.ignorepattern = ignorepattern
         self.pattern = pattern
+        # 待ち行列の制御やプロセスの入れ替えは AnalyzerPool が行う
+        pool_options = dict(max_queue=max_queue, max_requests=max_requests, max_rss=max_rss, memory_limit=memory_limit,
+                            cpus=cpus, nice=nice, ionice=ionice)
+        use_pool = workers > 1 or spares > 0 or any(value is not None for value in pool_options.values())
+        if quarantine is True:
+            quarantine = Quarantine()
+        self.quarantine = quarantine
+        if cache is True:
+            cache = AnalysisCache()
+        self.cache = cache
+        if normalizer is True:
+            normalizer = Normalizer()
+        self.normalizer = normalizer
         if server is not None:
-            self.analyzer = Analyzer(backend='socket', timeout=timeout, server=server, port=port,
-                                     socket_option='RUN -e2\n')
+            if connections > 1 or multithreading or max_queue is not None:
+                self.analyzer = AnalyzerPool(None, connections, timeout=timeout, backend='socket', server=server,
+                                             port=port, max_queue=max_queue, socket_option='RUN -e2\n',
+                                             quarantine=quarantine, coalesce=coalesce, cache=cache)
+            else:
+                self.analyzer = Analyzer(backend='socket', timeout=timeout, server=server, port=port,
+                                         socket_option='RUN -e2\n', quarantine=quarantine, coalesce=coalesce,
+                                         cache=cache)
         else:
             cmds = [self.command] + self.options
             if self.rcfile:
                 cmds += ['-r', self.rcfile]
-            self.analyzer = Analyzer(backend='subprocess', multithreading=multithreading, timeout=timeout, command=cmds)
+            if daemon is not None:
+                self.analyzer = Analyzer(backend='daemon', timeout=timeout, command=cmds, daemon=daemon,
+                                         quarantine=quarantine, coalesce=coalesce, cache=cache)
+            elif use_pool:
+                self.analyzer = AnalyzerPool(cmds, workers, timeout=timeout, spares=spares, quarantine=quarantine,
+                                             coalesce=coalesce, cache=cache, **pool_options)
+            else:
+                self.analyzer = Analyzer(backend='subprocess', multithreading=multithreading, timeout=timeout,
+                                         command=cmds, quarantine=quarantine, coalesce=coalesce, cache=cache)
 
         if self.rcfile and not os.path.isfile(os.path.expanduser(self.rcfile)):
             raise Exception("Can't read rcfile (%s)!" % self.rcfile)
-        if distutils.spawn.find_executable(self.command) is None:
+        if daemon is None and distutils.spawn.find_executable(self.command) is None:
             raise Exception("Can't find JUMAN command: %s" % self.command)
 
-    def juman_lines(self, input_str):
+    def prewarm_after_fork(self):
+        """ JUMANのプロセスを起動 (サーバーモードでは接続) しておく
+
+        fork した子プロセスは親から引き継いだJUMANのプロセスを使わず、最初の解析時に起動し直す。
+        gunicorn の post_fork フックなどでこの関数を呼ぶと、起動を最初の解析より前に済ませられる。
+        """
+        self.analyzer.prewarm_after_fork()
+
+    def juman_lines(self, input_str, priority='interactive', deadline=None):
         """ 入力文字列に対して形態素解析を行い、そのJuman出力結果を返す
 
         Args:
             input_str (str): 文を表す文字列
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
 
         Returns:
             str: Juman出力結果
         """
-        if '\n' in input_str:
-            input_str = input_str.replace('\n', '')
-            print('Analysis is done ignoring "\\n".', file=sys.stderr)
-        return self.analyzer.query(input_str, pattern=self.pattern)
+        input_str, _ = normalize(self.normalizer, input_str)
+        return self._query(input_str, priority, deadline)
+
+    def juman_lines_batch(self, input_strs, priority='batch', deadline=None):
+        """ 複数の入力文字列をまとめて形態素解析し、それぞれのJuman出力結果を返す
+
+        Args:
+            input_strs (list): 文を表す文字列のリスト
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
+
+        Returns:
+            list: Juman出力結果のリスト (入力と同じ順序)
+        """
+        input_strs = [normalize(self.normalizer, input_str)[0] for input_str in input_strs]
+        return self._query_batch(input_strs, priority, deadline)
+
+    def _query(self, input_str, priority, deadline):
+        return self.analyzer.query(remove_newline(input_str), pattern=self.pattern, priority=priority,
+                                   deadline=deadline)
+
+    def _query_batch(self, input_strs, priority, deadline):
+        return self.analyzer.query_batch([remove_newline(input_str) for input_str in input_strs], pattern=self.pattern,
+                                         priority=priority, deadline=deadline)
 
-    def juman(self, input_str, juman_format=JUMAN_FORMAT.DEFAULT):
+    def juman(self, input_str, juman_format=JUMAN_FORMAT.DEFAULT, priority='interactive', deadline=None):
         """ analysis関数と同じ """
         assert isinstance(input_str, six.text_type)
-        result = MList(self.juman_lines(input_str), juman_format)
+        input_str, normalized = normalize(self.normalizer, input_str)
+        result = MList(self._query(input_str, priority, deadline), juman_format)
+        result.normalized = normalized
         return result
 
-    def analysis(self, input_str, juman_format=JUMAN_FORMAT.DEFAULT):
+    def analysis(self, input_str, juman_format=JUMAN_FORMAT.DEFAULT, priority='interactive', deadline=None):
         """ 入力文字列に対して形態素解析し、その結果を MList オブジェクトとして返す
         
         Args:
             input_str (str): 文を表す文字列
             juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
 
         Returns:
             MList: 形態素列オブジェクト
         """
-        return self.juman(input_str, juman_format)
+        return self.juman(input_str, juman_format, priority=priority, deadline=deadline)
+
+    def analysis_batch(self, input_strs, juman_format=JUMAN_FORMAT.DEFAULT, priority='batch', deadline=None):
+        """ 複数の入力文字列をまとめて形態素解析し、MList オブジェクトのリストとして返す
+
+        1文ずつ analysis 関数を呼ぶ場合と異なり、前の文の解析結果を待たずに次の文をJUMANに渡す。
+
+        Args:
+            input_strs (list): 文を表す文字列のリスト
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
+
+        Returns:
+            list: MList オブジェクトのリスト (入力と同じ順序)
+        """
+        for input_str in input_strs:
+            assert isinstance(input_str, six.text_type)
+        normalized_list = [normalize(self.normalizer, input_str) for input_str in input_strs]
+        juman_lines_list = self._query_batch([text for text, _ in normalized_list], priority, deadline)
+        results = []
+        for lines, (_, normalized) in zip(juman_lines_list, normalized_list):
+            result = MList(lines, juman_format)
+            result.normalized = normalized
+            results.append(result)
+        return results
 
     def result(self, input_str, juman_format=JUMAN_FORMAT.DEFAULT):
         """ Juman出力結果に対して、その結果を MList オブジェクトとして返す
@@ -110,6 +244,114 @@ class Juman(object):
         return MList(input_str, juman_format)
 
 
+class AsyncJuman(object):
+    """ asyncio から JUMAN を利用するためのモジュール
+
+    解析中もイベントループをブロックしない。サーバーモードには対応していない。
+
+    Args:
+        command (str): JUMANの実行コマンド
+        timeout (int): 1文あたりの解析のタイムアウト (秒)
+        option (str): JUMAN解析オプション (ラティス形式 -s, ビーム幅 --beam <int>)
+        rcfile (str): JUMAN設定ファイルへのパス
+        pattern (str): JUMAN出力の終端記号
+        jumanpp (bool): JUMAN++を用いるかJUMANを用いるか。commandを指定した場合は無視される。
+    """
+
+    def __init__(self,
+                 command='jumanpp',
+                 timeout=30,
+                 option='',
+                 rcfile='',
+                 pattern=r'^EOS$',
+                 jumanpp=True,
+                 ):
+        if jumanpp or command != 'jumanpp':
+            self.command = command
+            self.options = option.split()
+        else:
+            self.command = 'juman'
+            self.options = option.split() + ['-e2', '-B']
+        self.timeout = timeout
+        self.rcfile = rcfile
+        self.pattern = pattern
+        cmds = [self.command] + self.options
+        if self.rcfile:
+            cmds += ['-r', self.rcfile]
+        self.analyzer = AsyncSubprocess(cmds, timeout=timeout)
+
+        if self.rcfile and not os.path.isfile(os.path.expanduser(self.rcfile)):
+            raise Exception("Can't read rcfile (%s)!" % self.rcfile)
+        if distutils.spawn.find_executable(self.command) is None:
+            raise Exception("Can't find JUMAN command: %s" % self.command)
+
+    async def close(self):
+        """ JUMANのプロセスを終了させる。イベントループを閉じる前に呼ぶ """
+        await self.analyzer.close()
+
+    async def juman_lines(self, input_str):
+        """ 入力文字列に対して形態素解析を行い、そのJuman出力結果を返す
+
+        Args:
+            input_str (str): 文を表す文字列
+
+        Returns:
+            str: Juman出力結果
+        """
+        return await self.analyzer.query(remove_newline(input_str), pattern=self.pattern)
+
+    async def juman_lines_stream(self, input_strs):
+        """ 入力文字列を次々に形態素解析し、そのJuman出力結果を入力と同じ順序で返す
+
+        Args:
+            input_strs: 文を表す文字列の (非同期) イテラブル
+
+        Yields:
+            str: Juman出力結果
+        """
+        async for juman_lines in self.analyzer.query_stream(_map_remove_newline(input_strs), pattern=self.pattern):
+            yield juman_lines
+
+    async def analysis(self, input_str, juman_format=JUMAN_FORMAT.DEFAULT):
+        """ 入力文字列に対して形態素解析し、その結果を MList オブジェクトとして返す
+
+        Args:
+            input_str (str): 文を表す文字列
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+
+        Returns:
+            MList: 形態素列オブジェクト
+        """
+        assert isinstance(input_str, six.text_type)
+        return MList(await self.juman_lines(input_str), juman_format)
+
+    async def analysis_stream(self, input_strs, juman_format=JUMAN_FORMAT.DEFAULT):
+        """ 入力文字列を次々に形態素解析し、その結果を MList オブジェクトとして入力と同じ順序で返す
+
+        Args:
+            input_strs: 文を表す文字列の (非同期) イテラブル
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+
+        Yields:
+            MList: 形態素列オブジェクト
+        """
+        async for juman_lines in self.juman_lines_stream(input_strs):
+            yield MList(juman_lines, juman_format)
+
+
+def remove_newline(input_str):
+    """ JUMANは1行を1文として扱うため、入力中の改行を取り除く """
+    if '\n' in input_str:
+        input_str = input_str.replace('\n', '')
+        print('Analysis is done ignoring "\\n".', file=sys.stderr)
+    return input_str
+
+
+async def _map_remove_newline(input_strs):
+    async for input_str in to_aiter(input_strs):
+        yield remove_newline(input_str)
+
+
 class JumanTest(unittest.TestCase):
 
     def setUp(self):
@@ -15,6 +15,8 @@ class MList(object):
         self._mrph = []
         self._readonly = False
         self.comment = ""
+        # Juman に normalizer を指定した場合の、正規化した入力文字列と元の文字列での位置 (NormalizedText)
+        self.normalized = None
         mid = 1
         if spec != "":
             for line in spec.split("\n"):
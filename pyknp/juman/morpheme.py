@@ -50,8 +50,21 @@ class Morpheme(object):
         repname (str): 代表表記
         ranks (set[int]): ラティスでのランク
         span (tuple): 形態素の位置 (開始位置, 終了位置), JUMAN出力形式がラティス形式の場合のみ
+
+    同じ行から作った形態素の情報は cache_size 行まで記憶しておき、2回目からは行をパースし直さずに使う
+    (形態素ID・位置以外の情報が同じ行は、ラティス形式でも同じ行とみなす)。
+    features は形態素ごとに新しいオブジェクトになる。
     """
 
+    # 記憶しておく行の数の上限。超えた場合は記憶した行をすべて忘れる。0 の場合は記憶しない
+    cache_size = 100000
+    _spec_cache = {}
+    _new_spec_cache = {}
+    # 記憶する情報 (形態素ごとに異なる形態素ID・位置を除く)
+    _SPEC_FIELDS = ('midasi', 'yomi', 'genkei', 'hinsi', 'hinsi_id', 'bunrui', 'bunrui_id', 'katuyou1', 'katuyou1_id',
+                    'katuyou2', 'katuyou2_id', 'imis', 'fstring', 'repname')
+    _NEW_SPEC_FIELDS = _SPEC_FIELDS + ('ranks',)
+
     def __init__(self, spec, mrph_id=None, juman_format=JUMAN_FORMAT.DEFAULT):
         assert isinstance(spec, six.text_type)
         assert mrph_id is None or isinstance(mrph_id, int)
@@ -83,6 +96,19 @@ class Morpheme(object):
             self._parse_new_spec(spec.strip("\n"))
     
     def _parse_new_spec(self, spec):
+        parts = spec.split("\t", 5)
+        # 形態素ID・位置を除いた部分が同じ行は同じ情報を持つ。欠けている列がある行は記憶しない
+        if len(parts) < 6 or spec.count("\t") < 17:
+            self._parse_new_spec_fields(spec)
+            return
+        self.mrph_id = int(parts[1])
+        self.prev_mrph_id = [int(mid) for mid in parts[2].split(";")]
+        self.span = (int(parts[3]), int(parts[4]))
+        if not self._load_cache(Morpheme._new_spec_cache, parts[5]):
+            self._parse_new_spec_fields(spec)
+            self._store_cache(Morpheme._new_spec_cache, parts[5], self._NEW_SPEC_FIELDS)
+
+    def _parse_new_spec_fields(self, spec):
         try:  # FIXME KNPの場合と同様、EOSをきちんと判定する
             parts = spec.split("\t")
             self.mrph_id = int(parts[1])
@@ -110,6 +136,45 @@ class Morpheme(object):
             pass
 
     def _parse_spec(self, spec):
+        if not self._load_cache(Morpheme._spec_cache, spec):
+            self._parse_spec_fields(spec)
+            self._store_cache(Morpheme._spec_cache, spec, self._SPEC_FIELDS)
+
+    def _load_cache(self, cache, key):
+        cached = cache.get(key)
+        if cached is None:
+            return False
+        fields, features = cached
+        self.__dict__.update(fields)
+        self.ranks = set(self.ranks)
+        if features is not None:
+            self.features = self.feature = self._copy_features(features)
+        return True
+
+    def _store_cache(self, cache, key, names):
+        if not Morpheme.cache_size:
+            return
+        if len(cache) >= Morpheme.cache_size:
+            cache.clear()
+        fields = {name: getattr(self, name) for name in names}
+        fields['ranks'] = set(self.ranks)
+        features = getattr(self, 'features', None)
+        cache[key] = (fields, self._copy_features(features) if features is not None else None)
+
+    @staticmethod
+    def _copy_features(features):
+        if isinstance(features, Features):
+            return features.copy()
+        # ラティス形式の素性情報は値がリストの辞書なので、リストも形態素ごとに作る
+        return {key: list(value) for key, value in features.items()}
+
+    @staticmethod
+    def clear_cache():
+        """ 記憶している行をすべて忘れる """
+        Morpheme._spec_cache.clear()
+        Morpheme._new_spec_cache.clear()
+
+    def _parse_spec_fields(self, spec):
         parts = []
         part = ''
         inside_quotes = False
@@ -26,6 +26,7 @@ class BList(object):
     Attributes:
         comment (str): KNP出力における、#から始まる行に書かれた文字列
         sid (str): 文ID (KNP出力中のS-ID)
+        normalized (NormalizedText): KNP に normalizer を指定した場合の、正規化した入力文字列と元の文字列での位置
     """
 
     def __init__(self, spec='', pattern='EOS', juman_format=JUMAN_FORMAT.DEFAULT):
@@ -35,6 +36,7 @@ class BList(object):
         self.juman_format = juman_format
         self.comment = ''
         self.sid = ''
+        self.normalized = None
         self._pinfos = []
         self.parse(spec)
         self._set_parent_child()
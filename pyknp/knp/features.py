@@ -52,6 +52,19 @@ class Features(dict):
     def pas(self):
         return self._tag.pas
 
+    def copy(self):
+        """ 同じfeature情報を持つ新しいオブジェクトを、feature情報をパースし直さずに作る
+
+        Returns:
+            Features: 新しいオブジェクト
+        """
+        features = Features.__new__(Features)
+        dict.update(features, self)
+        features.spec = self.spec
+        features.rels = list(self.rels) if self.rels is not None else None
+        features._tag = None
+        return features
+
 
 class FeaturesTest(unittest.TestCase):
 
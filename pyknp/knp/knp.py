@@ -5,13 +5,19 @@ from __future__ import unicode_literals
 
 import distutils.spawn
 import os
+import threading
 import unittest
 
 import six
+from six.moves import queue
 
 from pyknp import BList
-from pyknp import Juman, JUMAN_FORMAT
-from pyknp.utils.analyzer import Analyzer
+from pyknp import AsyncJuman, Juman, JUMAN_FORMAT
+from pyknp.juman.juman import remove_newline
+from pyknp.utils.analyzer import Analyzer, AnalyzerPool, Quarantine
+from pyknp.utils.cache import AnalysisCache
+from pyknp.utils.normalizer import Normalizer, normalize
+from pyknp.utils.process import AsyncSubprocess
 
 
 class KNP(object):
@@ -28,6 +34,35 @@ class KNP(object):
         jumanrcfile (str): JUMAN設定ファイルへのパス
         jumanpp (bool): JUMAN++を用いるかJUMANを用いるか
         multithreading (bool): 解析をメインスレッド以外から行う可能性があるか
+        workers (int): 並列に起動するKNP/JUMANプロセスの数 (2以上の場合はスレッドセーフ)
+        spares (int): 異常終了したプロセスと入れ替えるために予め起動しておく予備のKNP/JUMANプロセスの数
+        daemon (str): pyknp-server のUnixドメインソケットのパス。指定した場合はプロセスを起動せず pyknp-server に解析を依頼する
+        pipeline (bool): parse関数でJUMANの出力をPythonを経由せずOSのパイプで直接KNPに渡すか
+                         (サーバーモードでは無視される)
+        connections (int): サーバーモードで張る接続の数 (2以上の場合はスレッドセーフ)。
+                           server に '/' を含むパスを指定した場合はUnixドメインソケットで接続する
+        max_queue (int): 解析待ちの要求数の上限。指定した場合、上限を超えた要求は待たずに OverloadedError を送出する
+        max_requests (int): 1つのプロセスで解析する文数の上限。達したプロセスは新しいものと入れ替える
+        max_rss (int): プロセスの常駐メモリ (RSS, バイト) の上限。/proc から読み、超えたプロセスは新しいものと入れ替える
+        memory_limit (int): 起動するプロセスに設定するアドレス空間の上限 (RLIMIT_AS, バイト)
+        cpus (list): 各プロセスを固定するCPUコア (コア番号またはコア番号の集合) のリスト。i 番目のプロセスは cpus[i % len(cpus)] に固定される
+        nice (int): 起動するプロセスのnice値
+        ionice (tuple): 起動するプロセスのI/Oスケジューリングクラスとクラス内の優先度の組 (例: (3, None))
+        quarantine (Quarantine): 1文あたりのタイムアウトを超えた文を記録する先 (True の場合は新たに作る)。
+                                 記録された文は再び解析せず、degraded_option のKNPで解析する (指定がなければ QuarantinedError を送出する)
+        degraded_option (str): quarantine に記録された文の解析に用いる軽いKNP解析オプション (-tab -dpnd など)
+        coalesce (bool): 解析中の文と同じ文が解析を依頼された場合、解析し直さずに解析中の結果を待って使うか。
+                         前の文の解析結果を引き継ぐオプション (-anaphora など) と併用しないこと
+        cache (AnalysisCache): JUMAN/KNPの解析結果を記憶する先 (True の場合は新たに作る)。
+                               DiskCache を指定すると、ファイルに記憶して複数のプロセスで共有する。
+                               記憶している文は解析せず、記憶している結果から新たに BList を作る。
+                               コマンド・オプション・設定ファイルごとに区別して記憶するため、複数の Juman/KNP で共有できる。
+                               前の文の解析結果を引き継ぐオプション (-anaphora など) と併用しないこと
+        juman (Juman): parse関数などで形態素解析に用いる Juman。指定した場合は jumancommand などの JUMAN の設定と
+                       pipeline は無視される。オプションの異なる複数の KNP で同じ Juman を共有し、
+                       その Juman に cache を指定しておくと、同じ文の形態素解析は1度で済む
+        normalizer (Normalizer): JUMANに渡す前 (cache を引く前) に入力文字列を正規化する関数 (True の場合は Normalizer())。
+                                 parse関数などの結果の normalized 属性に、正規化した文字列と元の文字列での位置が入る
     """
 
     def __init__(self,
@@ -43,6 +78,24 @@ class KNP(object):
                  jumanoption='',
                  jumanpp=True,
                  multithreading=False,
+                 workers=1,
+                 spares=0,
+                 daemon=None,
+                 pipeline=False,
+                 connections=1,
+                 max_queue=None,
+                 max_requests=None,
+                 max_rss=None,
+                 memory_limit=None,
+                 cpus=None,
+                 nice=None,
+                 ionice=None,
+                 quarantine=None,
+                 degraded_option=None,
+                 coalesce=False,
+                 cache=None,
+                 juman=None,
+                 normalizer=None,
                  ):
         self.command = command
         self.server = server
@@ -51,57 +104,299 @@ class KNP(object):
         self.options = option.split()
         self.rcfile = rcfile
         self.pattern = pattern
+        pipeline = pipeline and server is None and daemon is None and juman is None
+        # 待ち行列の制御やプロセスの入れ替えは AnalyzerPool が行う
+        pool_options = dict(max_queue=max_queue, max_requests=max_requests, max_rss=max_rss, memory_limit=memory_limit,
+                            cpus=cpus, nice=nice, ionice=ionice)
+        use_pool = workers > 1 or spares > 0 or any(value is not None for value in pool_options.values())
+        if quarantine is True:
+            quarantine = Quarantine()
+        self.quarantine = quarantine
+        if cache is True:
+            cache = AnalysisCache()
+        self.cache = cache
+        if normalizer is True:
+            normalizer = Normalizer()
+        self.normalizer = normalizer
+        rcfile_option = ['-r', self.rcfile] if self.rcfile else []
+        degraded_cmds = None
+        fallback = None
+        if quarantine is not None and degraded_option is not None and server is None and daemon is None:
+            degraded_cmds = [self.command] + degraded_option.split() + rcfile_option
+            fallback = Analyzer(backend='subprocess', multithreading=True, timeout=timeout, command=degraded_cmds)
         if server is not None:
-            self.analyzer = Analyzer(backend='socket', timeout=timeout, server=server, port=port,
-                                     socket_option='RUN -tab -normal\n')
+            if connections > 1 or multithreading or max_queue is not None:
+                self.analyzer = AnalyzerPool(None, connections, timeout=timeout, backend='socket', server=server,
+                                             port=port, max_queue=max_queue, socket_option='RUN -tab -normal\n',
+                                             quarantine=quarantine, coalesce=coalesce, cache=cache)
+            else:
+                self.analyzer = Analyzer(backend='socket', timeout=timeout, server=server, port=port,
+                                         socket_option='RUN -tab -normal\n', quarantine=quarantine, coalesce=coalesce,
+                                         cache=cache)
         else:
-            cmds = [self.command] + self.options
-            if self.rcfile:
-                cmds += ['-r', self.rcfile]
-            self.analyzer = Analyzer(backend='subprocess', multithreading=multithreading, timeout=timeout, command=cmds)
+            cmds = [self.command] + self.options + rcfile_option
+            if daemon is not None:
+                self.analyzer = Analyzer(backend='daemon', timeout=timeout, command=cmds, daemon=daemon,
+                                         quarantine=quarantine, coalesce=coalesce, cache=cache)
+            elif use_pool:
+                # pipeline を用いる場合、KNP単体のプロセスは parse_juman_result でしか使わないため予備は起動しない
+                self.analyzer = AnalyzerPool(cmds, workers, timeout=timeout, spares=0 if pipeline else spares,
+                                             quarantine=quarantine, fallback=fallback, coalesce=coalesce, cache=cache,
+                                             **pool_options)
+            else:
+                self.analyzer = Analyzer(backend='subprocess', multithreading=multithreading, timeout=timeout,
+                                         command=cmds, quarantine=quarantine, fallback=fallback,
+                                         coalesce=coalesce, cache=cache)
         self.jumanpp = jumanpp
 
         if self.rcfile and not os.path.isfile(os.path.expanduser(self.rcfile)):
             raise Exception("Can't read rcfile (%s)!" % self.rcfile)
-        if distutils.spawn.find_executable(self.command) is None:
+        if daemon is None and distutils.spawn.find_executable(self.command) is None:
             raise Exception("Can't find KNP command: %s" % self.command)
 
-        self.juman = Juman(command=jumancommand, rcfile=jumanrcfile, option=jumanoption, jumanpp=self.jumanpp,
-                           multithreading=multithreading)
+        if juman is None:
+            juman = Juman(command=jumancommand, rcfile=jumanrcfile, option=jumanoption, jumanpp=self.jumanpp,
+                          multithreading=multithreading, workers=workers, spares=0 if pipeline else spares,
+                          daemon=daemon, quarantine=quarantine, coalesce=coalesce, cache=cache, **pool_options)
+        self.juman = juman
+
+        self.pipeline_analyzer = None
+        if pipeline:
+            cmds = [self.juman.analyzer.command, self.analyzer.command]
+            if fallback is not None:
+                fallback = Analyzer(backend='pipeline', multithreading=True, timeout=timeout,
+                                    command=[self.juman.analyzer.command, degraded_cmds])
+            if use_pool:
+                self.pipeline_analyzer = AnalyzerPool(cmds, workers, timeout=timeout, backend='pipeline',
+                                                      spares=spares, quarantine=quarantine, fallback=fallback,
+                                                      coalesce=coalesce, cache=cache, **pool_options)
+            else:
+                self.pipeline_analyzer = Analyzer(backend='pipeline', multithreading=multithreading, timeout=timeout,
+                                                  command=cmds, quarantine=quarantine, fallback=fallback,
+                                                  coalesce=coalesce, cache=cache)
+
+    def prewarm_after_fork(self):
+        """ parse関数で用いるKNP/JUMANのプロセスを起動 (サーバーモードでは接続) しておく
+
+        fork した子プロセスは親から引き継いだKNP/JUMANのプロセスを使わず、最初の解析時に起動し直す。
+        gunicorn の post_fork フックなどでこの関数を呼ぶと、起動を最初の解析より前に済ませられる。
+        """
+        if self.pipeline_analyzer is not None:
+            self.pipeline_analyzer.prewarm_after_fork()
+            return
+        self.analyzer.prewarm_after_fork()
+        self.juman.prewarm_after_fork()
 
     def knp(self, sentence):
         """ parse関数と同じ """
         self.parse(sentence)
 
-    def parse(self, sentence, juman_format=JUMAN_FORMAT.DEFAULT):
+    def parse(self, sentence, juman_format=JUMAN_FORMAT.DEFAULT, priority='interactive', deadline=None):
         """
         入力された文字列に対して形態素解析と構文解析を行い、文節列オブジェクトを返す
 
         Args:
             sentence (str): 文を表す文字列
             juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
 
         Returns:
             BList: 文節列オブジェクト
         """
         assert isinstance(sentence, six.text_type)
-        juman_lines = self.juman.juman_lines(sentence)
-        juman_str = "%s%s" % (juman_lines, self.pattern)
-        return self.parse_juman_result(juman_str, juman_format)
+        sentence, normalized = normalize(self.normalizer, sentence)
+        if self.pipeline_analyzer is not None:
+            knp_lines = self.pipeline_analyzer.query(remove_newline(sentence), pattern=r'^%s$' % self.pattern,
+                                                     priority=priority, deadline=deadline)
+            result = BList(knp_lines, self.pattern, juman_format)
+        else:
+            juman_lines = self.juman.juman_lines(sentence, priority=priority, deadline=deadline)
+            juman_str = "%s%s" % (juman_lines, self.pattern)
+            result = self.parse_juman_result(juman_str, juman_format, priority=priority, deadline=deadline)
+        result.normalized = normalized
+        return result
+
+    def parse_batch(self, sentences, juman_format=JUMAN_FORMAT.DEFAULT, priority='batch', deadline=None):
+        """
+        複数の文をまとめて形態素解析と構文解析を行い、文節列オブジェクトのリストを返す
 
-    def parse_juman_result(self, juman_str, juman_format=JUMAN_FORMAT.DEFAULT):
+        1文ずつ parse 関数を呼ぶ場合と異なり、前の文の解析結果を待たずに次の文をJUMAN/KNPに渡す。
+
+        Args:
+            sentences (list): 文を表す文字列のリスト
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
+
+        Returns:
+            list: BList オブジェクトのリスト (入力と同じ順序)
+        """
+        for sentence in sentences:
+            assert isinstance(sentence, six.text_type)
+        normalized_list = [normalize(self.normalizer, sentence) for sentence in sentences]
+        sentences = [sentence for sentence, _ in normalized_list]
+        if self.pipeline_analyzer is not None:
+            knp_lines_list = self.pipeline_analyzer.query_batch([remove_newline(sentence) for sentence in sentences],
+                                                                pattern=r'^%s$' % self.pattern, priority=priority,
+                                                                deadline=deadline)
+        else:
+            juman_strs = ["%s%s" % (juman_lines, self.pattern)
+                          for juman_lines in self.juman.juman_lines_batch(sentences, priority=priority,
+                                                                          deadline=deadline)]
+            knp_lines_list = self.analyzer.query_batch(juman_strs, pattern=r'^%s$' % self.pattern, priority=priority,
+                                                       deadline=deadline)
+        return [self._blist(knp_lines, juman_format, normalized)
+                for knp_lines, (_, normalized) in zip(knp_lines_list, normalized_list)]
+
+    def parse_iter(self, sentences, juman_format=JUMAN_FORMAT.DEFAULT, priority='batch', queue_size=16):
+        """
+        文を順に形態素解析と構文解析し、文節列オブジェクトを入力と同じ順序で返すジェネレータ
+
+        JUMANによる解析を別スレッドで先行させ、結果を最大 queue_size 文の待ち行列でKNPに渡す。
+        KNPが i 文目を解析している間にJUMANが i+1 文目以降を解析するため、
+        全体の処理時間はJUMANとKNPの処理時間の和ではなく、遅い方の処理時間に近づく。
+        sentences は全体をリストにせずに読み進めるため、大きなファイルを1行ずつ渡すこともできる。
+
+        Args:
+            sentences (iterable): 文を表す文字列を返すイテラブル
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+            priority (str): 解析の優先度 ('interactive' または 'batch')
+            queue_size (int): JUMANの解析結果をKNPに渡すまで保持する文数の上限
+
+        Yields:
+            BList: 文節列オブジェクト
+        """
+        if self.pipeline_analyzer is not None:
+            # OSのパイプでつないだJUMANとKNPは、まとめて渡せば並行して動く
+            chunk = []
+            for sentence in sentences:
+                assert isinstance(sentence, six.text_type)
+                chunk.append(normalize(self.normalizer, sentence))
+                if len(chunk) == queue_size:
+                    for result in self._parse_pipeline_chunk(chunk, juman_format, priority):
+                        yield result
+                    chunk = []
+            if chunk:
+                for result in self._parse_pipeline_chunk(chunk, juman_format, priority):
+                    yield result
+            return
+
+        juman_results = queue.Queue(maxsize=queue_size)
+        stopped = threading.Event()
+        end = object()
+
+        def put(item):
+            while not stopped.is_set():
+                try:
+                    juman_results.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def juman_stage():
+            try:
+                for sentence in sentences:
+                    assert isinstance(sentence, six.text_type)
+                    sentence, normalized = normalize(self.normalizer, sentence)
+                    put((self.juman.juman_lines(sentence, priority=priority), normalized))
+                    if stopped.is_set():
+                        return
+                put(end)
+            except BaseException as e:
+                put(e)
+
+        thread = threading.Thread(target=juman_stage)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                item = juman_results.get()
+                if item is end:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+                juman_lines, normalized = item
+                juman_str = "%s%s" % (juman_lines, self.pattern)
+                result = self.parse_juman_result(juman_str, juman_format, priority=priority)
+                result.normalized = normalized
+                yield result
+        finally:
+            # 途中で打ち切られた場合もJUMAN側のスレッドを止める
+            stopped.set()
+            thread.join()
+
+    def _parse_pipeline_chunk(self, chunk, juman_format, priority):
+        knp_lines_list = self.pipeline_analyzer.query_batch([remove_newline(sentence) for sentence, _ in chunk],
+                                                            pattern=r'^%s$' % self.pattern, priority=priority)
+        return [self._blist(knp_lines, juman_format, normalized)
+                for knp_lines, (_, normalized) in zip(knp_lines_list, chunk)]
+
+    def _blist(self, knp_lines, juman_format, normalized):
+        result = BList(knp_lines, self.pattern, juman_format)
+        result.normalized = normalized
+        return result
+
+    def parse_document(self, sentences, doc_id, juman_format=JUMAN_FORMAT.DEFAULT, priority='batch', deadline=None):
+        """
+        文書中の文をまとめて形態素解析と構文解析を行い、文ごとの文節列オブジェクトのリストを返す
+
+        各文に "# S-ID:<doc_id>-<文番号>" を付与して文書全体を1つのKNPプロセスに渡し、
+        出力を S-ID によって文ごとに振り分ける。文脈を用いる解析 (-anaphora など) ではこの単位で解析する。
+
+        Args:
+            sentences (list): 文書中の文を表す文字列のリスト
+            doc_id (str): 文書ID
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
+
+        Returns:
+            list: BList オブジェクトのリスト (入力と同じ順序)
+        """
+        for sentence in sentences:
+            assert isinstance(sentence, six.text_type)
+        normalized_list = [normalize(self.normalizer, sentence) for sentence in sentences]
+        sids = ["%s-%d" % (doc_id, i) for i in range(1, len(sentences) + 1)]
+        juman_lines_list = self.juman.juman_lines_batch([sentence for sentence, _ in normalized_list],
+                                                        priority=priority, deadline=deadline)
+        juman_strs = ["# S-ID:%s\n%s%s" % (sid, juman_lines, self.pattern)
+                      for sid, juman_lines in zip(sids, juman_lines_list)]
+        knp_lines_list = self.analyzer.query_batch(juman_strs, pattern=r'^%s$' % self.pattern, split=False,
+                                                   priority=priority, deadline=deadline)
+        blists = {}
+        for knp_lines in knp_lines_list:
+            blist = BList(knp_lines, self.pattern, juman_format)
+            blists[blist.sid] = blist
+        if set(blists) != set(sids):
+            raise Exception("KNP output does not match the S-IDs of the input: %s" % doc_id)
+        for sid, (_, normalized) in zip(sids, normalized_list):
+            blists[sid].normalized = normalized
+        return [blists[sid] for sid in sids]
+
+    def parse_juman_result(self, juman_str, juman_format=JUMAN_FORMAT.DEFAULT, priority='interactive', deadline=None):
         """
         JUMAN出力結果に対して構文解析を行い、文節列オブジェクトを返す
 
         Args:
             juman_str (str): ある文に関するJUMANの出力結果
             juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+            priority (str): 解析の優先度 ('interactive' または 'batch')。
+                            複数のプロセスで解析する場合に、'interactive' の要求が先に処理される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する
 
         Returns:
             BList: 文節列オブジェクト
         """
 
-        knp_lines = self.analyzer.query(juman_str, pattern=r'^%s$' % self.pattern)
+        knp_lines = self.analyzer.query(juman_str, pattern=r'^%s$' % self.pattern, priority=priority, deadline=deadline)
         return BList(knp_lines, self.pattern, juman_format)
 
     def reparse_knp_result(self, knp_str, juman_format=JUMAN_FORMAT.DEFAULT):
@@ -132,6 +427,94 @@ class KNP(object):
         return BList(input_str, self.pattern, juman_format)
 
 
+class AsyncKNP(object):
+    """ asyncio から KNP を利用するためのモジュール
+
+    解析中もイベントループをブロックしない。サーバーモードには対応していない。
+
+    Args:
+        command (str): KNPコマンド
+        timeout (int): 1文あたりの解析のタイムアウト (秒)
+        option (str): KNP解析オプション
+        rcfile (str): KNP設定ファイルへのパス
+        pattern (str): KNP出力の終端記号
+        jumancommand (str): JUMANコマンド
+        jumanrcfile (str): JUMAN設定ファイルへのパス
+        jumanpp (bool): JUMAN++を用いるかJUMANを用いるか
+    """
+
+    def __init__(self,
+                 command='knp',
+                 timeout=60,
+                 option='-tab',
+                 rcfile='',
+                 pattern=r'EOS',
+                 jumancommand='jumanpp',
+                 jumanrcfile='',
+                 jumanoption='',
+                 jumanpp=True,
+                 ):
+        self.command = command
+        self.timeout = timeout
+        self.options = option.split()
+        self.rcfile = rcfile
+        self.pattern = pattern
+        cmds = [self.command] + self.options
+        if self.rcfile:
+            cmds += ['-r', self.rcfile]
+        self.analyzer = AsyncSubprocess(cmds, timeout=timeout)
+        self.jumanpp = jumanpp
+
+        if self.rcfile and not os.path.isfile(os.path.expanduser(self.rcfile)):
+            raise Exception("Can't read rcfile (%s)!" % self.rcfile)
+        if distutils.spawn.find_executable(self.command) is None:
+            raise Exception("Can't find KNP command: %s" % self.command)
+
+        self.juman = AsyncJuman(command=jumancommand, rcfile=jumanrcfile, option=jumanoption, jumanpp=self.jumanpp)
+
+    async def close(self):
+        """ JUMAN/KNPのプロセスを終了させる。イベントループを閉じる前に呼ぶ """
+        await self.juman.close()
+        await self.analyzer.close()
+
+    async def parse(self, sentence, juman_format=JUMAN_FORMAT.DEFAULT):
+        """
+        入力された文字列に対して形態素解析と構文解析を行い、文節列オブジェクトを返す
+
+        Args:
+            sentence (str): 文を表す文字列
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+
+        Returns:
+            BList: 文節列オブジェクト
+        """
+        assert isinstance(sentence, six.text_type)
+        juman_lines = await self.juman.juman_lines(sentence)
+        juman_str = "%s%s" % (juman_lines, self.pattern)
+        knp_lines = await self.analyzer.query(juman_str, pattern=r'^%s$' % self.pattern)
+        return BList(knp_lines, self.pattern, juman_format)
+
+    async def parse_stream(self, sentences, juman_format=JUMAN_FORMAT.DEFAULT):
+        """
+        入力された文字列を次々に形態素解析・構文解析し、文節列オブジェクトを入力と同じ順序で返す
+
+        JUMANとKNPは並行して動作し、KNPがある文を解析している間にJUMANは次の文を解析する。
+
+        Args:
+            sentences: 文を表す文字列の (非同期) イテラブル
+            juman_format (JUMAN_FORMAT): Jumanのlattice出力形式
+
+        Yields:
+            BList: 文節列オブジェクト
+        """
+        async def juman_strs():
+            async for juman_lines in self.juman.juman_lines_stream(sentences):
+                yield "%s%s" % (juman_lines, self.pattern)
+
+        async for knp_lines in self.analyzer.query_stream(juman_strs(), pattern=r'^%s$' % self.pattern):
+            yield BList(knp_lines, self.pattern, juman_format)
+
+
 class KNPTest(unittest.TestCase):
 
     def setUp(self):
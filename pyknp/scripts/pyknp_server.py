@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import shlex
+import signal
+import sys
+
+from pyknp.utils.daemon import DaemonServer
+
+
+def main():
+    epilog = '''
+             try:
+             `pyknp-server -s /tmp/pyknp.sock -w 8` and
+             `KNP(daemon="/tmp/pyknp.sock")` from client processes
+             '''
+    parser = argparse.ArgumentParser(
+        prog='pyknp-server',
+        description='serve warm jumanpp/knp processes to pyknp clients over a Unix domain socket',
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+        epilog=epilog)
+    parser.add_argument("-s", "--socket", required=True,
+                        help="path of the Unix domain socket")
+    parser.add_argument("-c", "--command", action="append",
+                        help="command to keep running (repeatable; default: 'jumanpp' and 'knp -tab')")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of processes per command")
+    parser.add_argument("--spares", type=int, default=0,
+                        help="number of warm spare processes per command")
+    parser.add_argument("-q", "--max-queue", type=int, default=None,
+                        help="maximum number of waiting requests per command (unlimited if omitted)")
+    parser.add_argument("-t", "--timeout", type=float, default=180,
+                        help="timeout per sentence in seconds")
+    parser.add_argument("-m", "--mode", default="600",
+                        help="permission of the socket file (octal)")
+
+    args = parser.parse_args()
+
+    commands = [shlex.split(command) for command in (args.command or ["jumanpp", "knp -tab"])]
+    server = DaemonServer(args.socket, commands, workers=args.workers, timeout=args.timeout, spares=args.spares,
+                          max_queue=args.max_queue, mode=int(args.mode, 8))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1 +1,4 @@
-from .analyzer import Analyzer
+from .analyzer import Analyzer, AnalyzerPool, Quarantine
+from .cache import AnalysisCache, DiskCache
+from .normalizer import NormalizedText, Normalizer
+from .process import AnalysisTimeoutError, OverloadedError, QuarantinedError
@@ -1,15 +1,103 @@
-from .process import Socket, Subprocess, SubprocessThreadSafe
+import collections
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from .process import (AnalysisTimeoutError, DaemonClient, OverloadedError, QuarantinedError, Socket, Subprocess,
+                      SubprocessPipeline, SubprocessThreadSafe)
+
+# 解析要求の優先度 (先頭ほど優先される)
+PRIORITIES = ('interactive', 'batch')
+
+
+class Quarantine(object):
+    """ 1文あたりのタイムアウトを超えた入力を記録するクラス
+
+    記録した入力は再び解析せず、代わりの解析器に渡すか QuarantinedError を送出する。
+    複数の Analyzer で共有できる。
+
+    Args:
+        maxsize (int): 記録する入力の数の上限。超えた場合は古いものから忘れる
+    """
+
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._inputs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __contains__(self, input_str):
+        return input_str in self._inputs
+
+    def __len__(self):
+        return len(self._inputs)
+
+    def add(self, input_str):
+        with self._lock:
+            self._inputs[input_str] = True
+            self._inputs.move_to_end(input_str)
+            while len(self._inputs) > self.maxsize:
+                self._inputs.popitem(last=False)
+
+    def discard(self, input_str):
+        with self._lock:
+            self._inputs.pop(input_str, None)
+
+    def inputs(self):
+        """ 記録している入力のリストを古い順に返す """
+        with self._lock:
+            return list(self._inputs)
+
+
+class _InFlight(object):
+    """ 解析中の入力の結果を、同じ入力を後から依頼した呼び出し元に渡すためのクラス """
+
+    def __init__(self, priority):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.priority = priority
+
+    def serves(self, priority):
+        """ priority の要求がこの解析の結果を待ってよいか (優先度が同じか高い解析の結果だけを待つ) """
+        return PRIORITIES.index(self.priority) <= PRIORITIES.index(priority)
+
+    def declined(self, error):
+        """ error が入力によらず、解析を依頼した呼び出し元の締め切りや待ち行列の都合で送出されたものか """
+        if error is not self.error:
+            return False
+        return isinstance(error, OverloadedError) or \
+            (isinstance(error, AnalysisTimeoutError) and not error.exceeded_timeout)
+
+    def wait(self, deadline):
+        timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+        if not self.event.wait(timeout):
+            raise OverloadedError('The deadline has passed while waiting for the same input being analyzed')
+        if self.error is not None:
+            raise self.error
+        return self.result
 
 
 class Analyzer(object):
     """サーバーやサブプロセスと通信して解析を行うクラス
 
     Args:
-        backend (str): サーバーとサブプロセスのどちらで解析するか
-        server (str): サーバーのホスト名
+        backend (str): サーバー ('socket') とサブプロセス ('subprocess') のどちらで解析するか。
+                       'pipeline' の場合は command に与えた複数のコマンドをパイプでつないで実行する
+        server (str): サーバーのホスト名。'/' を含む場合はUnixドメインソケットのパスとみなす
         port (int): サーバーのポート番号
         socket_option (str): ソケット通信の際のオプション
         command (list): サブプロセスに渡すコマンド
+        daemon (str): pyknp-server のUnixドメインソケットのパス。指定した場合は pyknp-server に解析を依頼する
+        quarantine (Quarantine): 1文あたりのタイムアウトを超えた入力を記録する先。記録された入力は解析しない
+        fallback (Analyzer): quarantine に記録された入力を代わりに解析する解析器 (軽いオプションのKNPなど)。
+                             None の場合、記録された入力に対しては QuarantinedError を送出する
+        coalesce (bool): True の場合、解析中の入力と同じ入力が依頼されたら解析し直さずに解析中の結果を待って返す。
+                         また query_batch (split=True) の入力に重複があれば1度だけ解析する。
+                         前の文の解析結果を引き継ぐオプション (-anaphora など) を使う場合は指定しないこと
+        cache (AnalysisCache): 解析結果を記憶する先。記憶している入力は解析せずに記憶している結果を返す。
+                               query_batch (split=False) の結果は記憶しない
     """
 
     def __init__(self,
@@ -20,6 +108,11 @@ class Analyzer(object):
                  socket_option=None,
                  command=None,
                  timeout=180,
+                 daemon=None,
+                 quarantine=None,
+                 fallback=None,
+                 coalesce=False,
+                 cache=None,
                  ):
         self.backend = backend
         self.multithreading = multithreading
@@ -32,18 +125,607 @@ class Analyzer(object):
 
         self.subprocess = None
         self.command = command
+        self.daemon = daemon
+        self.quarantine = quarantine
+        self.fallback = fallback
+        self.coalesce = coalesce
+        self.cache = cache
+        # コマンドのバージョンの取得などに時間がかかる場合があるため、解析の前に済ませておく
+        self._cache_fingerprint = cache.fingerprint(self) if cache is not None else None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def query(self, input_str, pattern, priority='interactive', deadline=None):
+        # fork した子プロセスでは、親で解析中だった要求の結果を待たないようにする
+        self._check_fork()
+        self._check_priority(priority)
+        if self.cache is not None:
+            result = self.cache.get(self._cache_key(input_str, pattern))
+            if result is not None:
+                return result
+        if not self.coalesce:
+            return self._query_once(input_str, pattern, priority, deadline)
+        key = (input_str, pattern)
+        while True:
+            with self._inflight_lock:
+                call = self._inflight.get(key)
+                # 優先度の低い解析は待たずに自分で解析し、以降の同じ入力の要求にはこちらの結果を渡す
+                leader = call is None or not call.serves(priority)
+                if leader:
+                    call = self._inflight[key] = _InFlight(priority)
+            if leader:
+                break
+            try:
+                return call.wait(deadline)
+            except Exception as e:
+                # 先に依頼した呼び出し元の締め切りなどで断られた場合は、自分の締め切りで依頼し直す
+                if not call.declined(e):
+                    raise
+        try:
+            call.result = self._query_once(input_str, pattern, priority, deadline)
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._inflight_lock:
+                if self._inflight.get(key) is call:
+                    del self._inflight[key]
+            call.event.set()
 
-    def query(self, input_str, pattern):
+    def _query_once(self, input_str, pattern, priority, deadline):
+        if self.quarantine is not None and input_str in self.quarantine:
+            if self.fallback is None:
+                raise QuarantinedError([input_str])
+            return self.fallback.query(input_str, pattern, priority=priority, deadline=deadline)
+        self._check_deadline(deadline)
+        try:
+            result = self._query(input_str, pattern, priority, deadline)
+        except AnalysisTimeoutError as e:
+            self._quarantine(e)
+            raise
+        if self.cache is not None:
+            self.cache.put(self._cache_key(input_str, pattern), result)
+        return result
+
+    def _cache_key(self, input_str, pattern):
+        if self._cache_fingerprint is None:
+            self._cache_fingerprint = self.cache.fingerprint(self)
+        return self._cache_fingerprint, pattern, input_str
+
+    def query_batch(self, input_strs, pattern, split=True, priority='batch', deadline=None):
+        """ 複数の入力をまとめて解析し、入力と同じ順序で結果を返す
+
+        cache に記憶している入力は解析せず、記憶している結果を使う。quarantine に記録された入力は解析せず、fallback に渡す。
+
+        Args:
+            input_strs (list): 入力文字列のリスト
+            pattern (str): 出力の終端記号
+            split (bool): 入力を複数のサブプロセスに分配してよいか。
+                          False の場合は1つのサブプロセスで順に解析する (文脈を引き継ぐ解析の場合)
+            priority (str): 'interactive' または 'batch'。AnalyzerPool と pyknp-server でのみ考慮される
+            deadline (float): 解析の締め切り (time.monotonic() の値)。
+                              過ぎている場合や間に合わないと見込まれる場合は解析を始めずに OverloadedError を送出する。
+                              解析中に過ぎた場合は解析中のサブプロセスを終了させ、AnalysisTimeoutError を送出する
+        """
+        self._check_fork()
+        self._check_priority(priority)
+        input_strs = list(input_strs)
+        if self.cache is None or not split:
+            return self._query_batch_once(input_strs, pattern, split, priority, deadline)
+        results = [self.cache.get(self._cache_key(input_str, pattern)) for input_str in input_strs]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if missing:
+            missing_results = self._query_batch_once([input_strs[i] for i in missing], pattern, split, priority,
+                                                     deadline)
+            for i, result in zip(missing, missing_results):
+                results[i] = result
+        return results
+
+    def _query_batch_once(self, input_strs, pattern, split, priority, deadline):
+        if self.coalesce and split:
+            unique_strs = list(collections.OrderedDict.fromkeys(input_strs))
+            if len(unique_strs) < len(input_strs):
+                unique_results = dict(zip(unique_strs, self._query_batch_once(unique_strs, pattern, split, priority,
+                                                                              deadline)))
+                return [unique_results[input_str] for input_str in input_strs]
+        if self.quarantine is not None:
+            quarantined = [i for i, input_str in enumerate(input_strs) if input_str in self.quarantine]
+            if quarantined:
+                return self._query_batch_quarantined(input_strs, quarantined, pattern, split, priority, deadline)
+        self._check_deadline(deadline)
+        try:
+            results = self._query_batch(input_strs, pattern, split, priority, deadline)
+        except AnalysisTimeoutError as e:
+            self._quarantine(e)
+            raise
+        # 文脈を引き継ぐ解析の結果は前の入力に依存するため記憶しない
+        if self.cache is not None and split:
+            for input_str, result in zip(input_strs, results):
+                self.cache.put(self._cache_key(input_str, pattern), result)
+        return results
+
+    def _query(self, input_str, pattern, priority, deadline):
+        backend = self._backend()
+        try:
+            if isinstance(backend, DaemonClient):
+                return backend.query(input_str, pattern=pattern, priority=priority, deadline=deadline)
+            if isinstance(backend, Socket):
+                return backend.query(input_str, pattern=pattern)
+            return backend.query(input_str, pattern=pattern, deadline=deadline)
+        except Exception:
+            self._discard_backend(backend)
+            raise
+
+    def _query_batch(self, input_strs, pattern, split, priority, deadline):
+        backend = self._backend()
+        try:
+            if isinstance(backend, DaemonClient):
+                return backend.query_batch(input_strs, pattern=pattern, split=split, priority=priority,
+                                           deadline=deadline)
+            if isinstance(backend, Socket):
+                return backend.query_batch(input_strs, pattern=pattern)
+            return backend.query_batch(input_strs, pattern=pattern, deadline=deadline)
+        except Exception:
+            self._discard_backend(backend)
+            raise
+
+    def _query_batch_quarantined(self, input_strs, quarantined, pattern, split, priority, deadline):
+        if self.fallback is None:
+            raise QuarantinedError([input_strs[i] for i in quarantined])
+        if not split:
+            # 文脈を引き継ぐ解析では、まとめて代わりの解析器で解析する
+            return self.fallback.query_batch(input_strs, pattern, split=False, priority=priority, deadline=deadline)
+        results = [None] * len(input_strs)
+        fallback_results = self.fallback.query_batch([input_strs[i] for i in quarantined], pattern,
+                                                     priority=priority, deadline=deadline)
+        for i, result in zip(quarantined, fallback_results):
+            results[i] = result
+        rest = sorted(set(range(len(input_strs))) - set(quarantined))
+        if rest:
+            rest_results = self._query_batch_once([input_strs[i] for i in rest], pattern, split, priority, deadline)
+            for i, result in zip(rest, rest_results):
+                results[i] = result
+        return results
+
+    def _quarantine(self, error):
+        # 要求の締め切りを過ぎただけの場合は入力のせいとは限らないため記録しない
+        if self.quarantine is not None and error.exceeded_timeout:
+            self.quarantine.add(error.input)
+
+    def prewarm_after_fork(self):
+        """ サブプロセスの起動やサーバーへの接続を済ませておく
+
+        fork した子プロセス (gunicorn の post_fork フックなど) で呼ぶと、最初の解析で起動を待たずに済む。
+        呼ばなかった場合も、子プロセスでの最初の解析時に親から引き継いだものを使わずに起動し直す。
+        """
+        self._check_fork()
+        self._backend()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._reset_after_fork()
+
+    def _reset_after_fork(self):
+        # 親プロセスと共有しているパイプやソケットは参照を捨てるだけにする (サブプロセスは親が引き続き使う)
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self.socket = None
+        self.subprocess = None
+
+    @staticmethod
+    def _check_priority(priority):
+        if priority not in PRIORITIES:
+            raise Exception("Unknown priority: %s" % priority)
+
+    @staticmethod
+    def _check_deadline(deadline):
+        if deadline is not None and time.monotonic() >= deadline:
+            raise OverloadedError('The deadline has passed before the analysis started')
+
+    def _backend(self):
+        self._check_fork()
         if not self.socket and not self.subprocess:
-            if self.server is not None:
-                self.socket = Socket(self.server, self.port, self.socket_option)
-            else:
-                if self.multithreading is True:
-                    self.subprocess = SubprocessThreadSafe(self.command, timeout=self.timeout)
-                else:
-                    self.subprocess = Subprocess(self.command, timeout=self.timeout)
+            with self._lock:
+                if not self.socket and not self.subprocess:
+                    if self.daemon is not None:
+                        self.socket = DaemonClient(self.daemon, self.command, timeout=self.timeout)
+                    elif self.server is not None:
+                        self.socket = Socket(self.server, self.port, self.socket_option, timeout=self.timeout)
+                    elif self.multithreading is True:
+                        self.subprocess = SubprocessThreadSafe(self.command, timeout=self.timeout,
+                                                               subprocess_class=self._subprocess_class())
+                    else:
+                        self.subprocess = self._subprocess_class()(self.command, timeout=self.timeout)
 
         if self.socket:
-            return self.socket.query(input_str, pattern=pattern)
+            return self.socket
         else:
-            return self.subprocess.query(input_str, pattern=pattern)
+            return self.subprocess
+
+    def _discard_backend(self, backend):
+        # 出力を読み切れていない可能性があるため、次の解析ではサブプロセスの起動やサーバーへの接続をやり直す
+        if isinstance(backend, Subprocess):
+            backend.kill()
+            with self._lock:
+                if self.subprocess is backend:
+                    self.subprocess = None
+        elif isinstance(backend, Socket):
+            with self._lock:
+                if self.socket is backend:
+                    self.socket = None
+
+    def _subprocess_class(self):
+        return SubprocessPipeline if self.backend == 'pipeline' else Subprocess
+
+
+class AnalyzerPool(Analyzer):
+    """複数のサブプロセスを起動し、並列に解析を行うクラス
+
+    backend='socket' の場合はサブプロセスの代わりにサーバーへの接続を複数張り、同様に並列に解析を行う。
+
+    各サブプロセスは同時に1つの入力しか扱わないため、入力は空いているサブプロセスのうち、
+    これまでの処理数が最も少ないものに割り当てられる。
+    すべてのサブプロセスが解析中の場合は、いずれかが空くまで待つ。
+    待っている要求の中では priority='interactive' のものが 'batch' のものより先にサブプロセスを割り当てられる。
+    まとめて解析する入力は batch_size 文ずつサブプロセスを割り当て直すため、
+    大量の 'batch' の入力を解析している間も 'interactive' の要求の待ち時間は batch_size 文の解析時間に収まる。
+
+    待っている要求の数が max_queue に達している場合や、これまでの1文あたりの解析時間から見て
+    締め切りまでに解析を終えられないと見込まれる場合は、待たずに OverloadedError を送出する。
+
+    終了していたり、タイムアウトなどで出力を読み切れなかったりしたサブプロセスは終了させて破棄し、
+    予め起動しておいた予備のサブプロセスと入れ替える。破棄したサブプロセスの代わりはバックグラウンドで起動する。
+
+    解析した文の数が max_requests に達したり、常駐メモリが max_rss を超えたりしたサブプロセスも新しいものと入れ替える。
+    予備がない場合は代わりをバックグラウンドで起動し、起動するまでは古いサブプロセスで解析を続ける。
+
+    cpus を指定した場合、i 番目のサブプロセスは cpus[i % len(cpus)] のコアに固定される。
+    予備や入れ替えたサブプロセスも、割り当てられた番号のコアに固定し直す。
+
+    Args:
+        command (list): サブプロセスに渡すコマンド
+        workers (int): 起動するサブプロセスの数
+        timeout (float): 1文あたりの解析のタイムアウト (秒)
+        backend (str): 'subprocess', 'pipeline' または 'socket'
+        spares (int): 予め起動しておく予備のサブプロセスの数
+        server (str): backend='socket' の場合のサーバーのホスト名またはUnixドメインソケットのパス
+        port (int): backend='socket' の場合のサーバーのポート番号
+        socket_option (str): backend='socket' の場合のソケット通信の際のオプション
+        max_queue (int): 解析待ちの要求数の上限。None の場合は上限なし
+        max_requests (int): 1つのサブプロセスで解析する文数の上限
+        max_rss (int): サブプロセスの常駐メモリ (RSS, バイト) の上限
+        memory_limit (int): 起動するサブプロセスに設定するアドレス空間の上限 (RLIMIT_AS, バイト)
+        cpus (list): 各サブプロセスを固定するCPUコア (コア番号またはコア番号の集合) のリスト
+        nice (int): 起動するサブプロセスのnice値
+        ionice (tuple): 起動するサブプロセスのI/Oスケジューリングクラスとクラス内の優先度の組 (例: (2, 7), (3, None))。
+                        ionice コマンドを用いる
+        quarantine (Quarantine): Analyzer を参照
+        fallback (Analyzer): Analyzer を参照
+        coalesce (bool): Analyzer を参照
+        cache (AnalysisCache): Analyzer を参照
+    """
+
+    batch_size = 32
+
+    def __init__(self, command, workers, timeout=180, backend='subprocess', spares=0,
+                 server=None, port=None, socket_option=None, max_queue=None, max_requests=None, max_rss=None,
+                 memory_limit=None, cpus=None, nice=None, ionice=None, quarantine=None, fallback=None,
+                 coalesce=False, cache=None):
+        super(AnalyzerPool, self).__init__(backend=backend, multithreading=True, command=command,
+                                           timeout=timeout, server=server, port=port, socket_option=socket_option,
+                                           quarantine=quarantine, fallback=fallback, coalesce=coalesce, cache=cache)
+        assert workers >= 1
+        self.workers = workers
+        self.spares = spares
+        self.max_queue = max_queue
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.memory_limit = memory_limit
+        self.cpus = [{cpu} if isinstance(cpu, int) else set(cpu) for cpu in cpus] if cpus else None
+        self.nice = nice
+        self.ionice = ionice
+        self._tickets = itertools.count()
+        self._time_per_input = None
+        self._init_workers()
+
+    def _init_workers(self):
+        self._processes = [None] * self.workers
+        self._spare_processes = []
+        self._starting_spares = 0
+        self._idle = list(range(self.workers))
+        self._served = [0] * self.workers
+        self._waiting = []
+        # 代わりのサブプロセスをバックグラウンドで起動している番号
+        self._starting = set()
+        self._cond = threading.Condition()
+        self._fill_spares()
+
+    def _query(self, input_str, pattern, priority, deadline):
+        kwargs = self._query_kwargs(deadline)
+        return self._call(lambda process: process.query(input_str, pattern=pattern, **kwargs), priority, deadline)
+
+    def _query_batch(self, input_strs, pattern, split, priority, deadline):
+        """ 入力を各サブプロセスに分配して並列に解析し、入力と同じ順序で結果を返す """
+        if not input_strs:
+            return []
+        kwargs = self._query_kwargs(deadline)
+        if not split:
+            return self._call(lambda process: process.query_batch(input_strs, pattern=pattern, **kwargs), priority,
+                              deadline, size=len(input_strs))
+        size = -(-len(input_strs) // self.workers)
+        chunks = [input_strs[i:i + size] for i in range(0, len(input_strs), size)]
+        # 受け付けるかどうかは要求全体について一度だけ判断し、途中の小さなバッチでは断らない
+        with self._cond:
+            self._admit((PRIORITIES.index(priority), next(self._tickets), size), deadline)
+        results = [None] * len(chunks)
+        errors = []
+        # いずれかの入力が失敗した時点で、他のサブプロセスに残りの入力を渡すのをやめる
+        failed = threading.Event()
+
+        def run(i):
+            try:
+                results[i] = []
+                for j in range(0, len(chunks[i]), self.batch_size):
+                    if failed.is_set():
+                        return
+                    inputs = chunks[i][j:j + self.batch_size]
+                    results[i] += self._call(lambda process: process.query_batch(inputs, pattern=pattern, **kwargs),
+                                             priority, deadline, size=len(inputs), admitted=True)
+            except Exception as e:
+                errors.append(e)
+                failed.set()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(len(chunks))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return [result for chunk in results for result in chunk]
+
+    def prewarm_after_fork(self):
+        """ すべてのサブプロセスを並列に起動しておく (Analyzer.prewarm_after_fork を参照) """
+        self._check_fork()
+        indices = [self._acquire() for _ in range(self.workers)]
+        try:
+            threads = [threading.Thread(target=self._worker, args=(index,)) for index in indices]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            for index in indices:
+                self._release(index)
+
+    def _reset_after_fork(self):
+        # 親から引き継いだサブプロセスやロック、起動中だった予備の数はいずれも子プロセスでは使えない
+        super(AnalyzerPool, self)._reset_after_fork()
+        self._init_workers()
+
+    def _query_kwargs(self, deadline):
+        # サーバーへの接続は締め切りによらずソケットのタイムアウトで打ち切る
+        return {} if self.backend == 'socket' else {'deadline': deadline}
+
+    def _call(self, func, priority='interactive', deadline=None, size=1, admitted=False):
+        self._check_fork()
+        index = self._acquire(priority, deadline, size, admitted)
+        try:
+            process = self._worker(index)
+            start = time.monotonic()
+            try:
+                result = func(process)
+            except Exception:
+                self._discard(index, process)
+                raise
+            self._record_time((time.monotonic() - start) / size)
+            if self._expired(process):
+                self._recycle(index, process)
+            return result
+        finally:
+            self._release(index)
+
+    def _acquire(self, priority='interactive', deadline=None, size=1, admitted=False):
+        """ 空いているサブプロセスの番号を返す。admitted が真の場合は受け付けるかどうかの判断を省く """
+        self._check_priority(priority)
+        with self._cond:
+            # 優先度が高く、先に来た要求から順にサブプロセスを割り当てる
+            ticket = (PRIORITIES.index(priority), next(self._tickets), size)
+            if not admitted:
+                self._admit(ticket, deadline)
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while not self._idle or self._waiting[0] != ticket:
+                    if deadline is None:
+                        self._cond.wait()
+                        continue
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise OverloadedError('The deadline has passed while waiting for the analyzer')
+                    self._cond.wait(remaining)
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                # 次に優先される要求が空いているサブプロセスを受け取れるように起こす
+                self._cond.notify_all()
+            index = min(self._idle, key=lambda i: self._served[i])
+            self._idle.remove(index)
+            self._served[index] += 1
+            return index
+
+    def _admit(self, ticket, deadline):
+        """ 待っている要求が多すぎる場合や締め切りまでに終わる見込みがない場合に OverloadedError を送出する (_cond を保持して呼ぶ) """
+        busy = not self._idle or bool(self._waiting)
+        if busy and self.max_queue is not None and len(self._waiting) >= self.max_queue:
+            raise OverloadedError('Too many requests are waiting for the analyzer (max_queue=%d)' % self.max_queue)
+        if deadline is not None and time.monotonic() + self._estimate(ticket, busy) > deadline:
+            raise OverloadedError('The analysis is not expected to finish before the deadline')
+
+    def _estimate(self, ticket, busy):
+        """ 先に待っている要求と ticket の要求の解析が終わるまでの見込みの時間を返す """
+        if self._time_per_input is None:
+            return 0
+        inputs = ticket[2]
+        if busy:
+            inputs += sum(waiting[2] for waiting in self._waiting if waiting < ticket) / float(self.workers)
+        return inputs * self._time_per_input
+
+    def _record_time(self, elapsed):
+        with self._cond:
+            if self._time_per_input is None:
+                self._time_per_input = elapsed
+            else:
+                self._time_per_input = 0.8 * self._time_per_input + 0.2 * elapsed
+
+    def _release(self, index):
+        with self._cond:
+            self._idle.append(index)
+            # 待っている要求のうち優先度の最も高いものだけが割り当てを受けられるため、全員を起こす
+            self._cond.notify_all()
+
+    def _worker(self, index):
+        with self._cond:
+            while True:
+                process = self._processes[index]
+                if process is not None and process.is_alive():
+                    break
+                process = self._processes[index] = self._pop_spare()
+                if process is not None or index not in self._starting:
+                    break
+                # バックグラウンドで起動中の代わりを待ち、同じサブプロセスを重ねて起動しない
+                self._cond.wait()
+        if process is None:
+            process = self._spawn()
+            with self._cond:
+                self._processes[index] = process
+        self._pin(index, process)
+        return process
+
+    def _pin(self, index, process):
+        if self.cpus is None or not isinstance(process, Subprocess):
+            return
+        cpus = self.cpus[index % len(self.cpus)]
+        if process.cpus != cpus:
+            try:
+                process.set_affinity(cpus)
+            except ProcessLookupError:
+                # 終了していたサブプロセスは解析時に検出して入れ替える
+                pass
+
+    def _spawn(self):
+        if self.backend == 'socket':
+            return Socket(self.server, self.port, self.socket_option, timeout=self.timeout)
+        command = self.command
+        if self.ionice is not None:
+            if self.backend == 'pipeline':
+                command = [self._ionice_command(cmd) for cmd in command]
+            else:
+                command = self._ionice_command(command)
+        process = self._subprocess_class()(command, timeout=self.timeout)
+        if self.memory_limit is not None or self.nice is not None:
+            try:
+                process.set_limits(self.memory_limit, self.nice)
+            except ProcessLookupError:
+                # 終了していたサブプロセスは解析時に検出して入れ替える
+                pass
+        return process
+
+    def _ionice_command(self, command):
+        io_class, level = self.ionice
+        prefix = ['ionice', '-c', str(io_class)]
+        if level is not None:
+            prefix += ['-n', str(level)]
+        return prefix + list(command)
+
+    def _expired(self, process):
+        if not isinstance(process, Subprocess):
+            return False
+        if self.max_requests is not None and process.queries >= self.max_requests:
+            return True
+        if self.max_rss is not None:
+            rss = process.rss()
+            return rss is not None and rss > self.max_rss
+        return False
+
+    def _recycle(self, index, process):
+        """ 寿命に達したサブプロセスを予備と入れ替える。予備がなければ代わりをバックグラウンドで起動する """
+        with self._cond:
+            if self._processes[index] is not process or index in self._starting:
+                return
+            spare = self._pop_spare()
+            if spare is not None:
+                self._processes[index] = spare
+                return
+            self._starting.add(index)
+        self._start_background(self._replace, index, process)
+
+    def _replace(self, index, process):
+        """ 代わりのサブプロセスを起動し、index 番目が process のままか空いていれば入れ替える """
+        try:
+            new_process = self._spawn()
+        except OSError:
+            new_process = None
+        with self._cond:
+            self._starting.discard(index)
+            current = self._processes[index]
+            # 古いサブプロセスは解析中でなくなった時点で参照が切れ、終了される
+            if new_process is not None and (current is process or current is None):
+                self._processes[index] = new_process
+            elif new_process is not None and len(self._spare_processes) < self.spares:
+                self._spare_processes.append(new_process)
+            # 起動を待っている要求を起こす (起動に失敗した場合はその要求が起動し直す)
+            self._cond.notify_all()
+
+    def _discard(self, index, process):
+        """ 出力を読み切れていない可能性のあるサブプロセスを予備と入れ替え、代わりをバックグラウンドで起動する """
+        # 解析中の文に時間がかかっている場合に備え、参照が切れるのを待たずに終了させる
+        if isinstance(process, Subprocess):
+            process.kill()
+        with self._cond:
+            # 寿命による入れ替えが済んでいる場合、新しいサブプロセスはそのまま使う
+            if self._processes[index] is not process:
+                return
+            self._processes[index] = self._pop_spare()
+            # 寿命による入れ替えで代わりを起動中の場合は、それが空いた番号に入る
+            if self._processes[index] is not None or index in self._starting:
+                return
+            self._starting.add(index)
+        self._start_background(self._replace, index, None)
+
+    def _pop_spare(self):
+        while self._spare_processes:
+            process = self._spare_processes.pop()
+            if process.is_alive():
+                self._start_background(self._fill_spares)
+                return process
+        return None
+
+    def _fill_spares(self):
+        with self._cond:
+            count = self.spares - len(self._spare_processes) - self._starting_spares
+            if count <= 0:
+                return
+            self._starting_spares += count
+        for _ in range(count):
+            self._start_background(self._start_spare)
+
+    def _start_spare(self):
+        try:
+            process = self._spawn()
+        except OSError:
+            process = None
+        with self._cond:
+            self._starting_spares -= 1
+            if process is not None:
+                self._spare_processes.append(process)
+
+    @staticmethod
+    def _start_background(target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,261 @@
+import collections
+import hashlib
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+
+class AnalysisCache(object):
+    """ JUMAN/KNPの解析結果 (出力文字列) を記憶しておくLRUキャッシュ
+
+    解析器の設定 (コマンド、オプション、設定ファイルなど) と入力文字列の組をキーとするため、
+    設定の異なる複数の Analyzer で共有できる。
+    結果は出力文字列のまま記憶するので、ヒットした場合も BList/MList は毎回新しく作られる。
+
+    Args:
+        maxsize (int): 記憶する結果の数の上限。None の場合は数で制限しない
+        maxbytes (int): 記憶する入力と結果の大きさ (sys.getsizeof によるおおよそのバイト数) の合計の上限。
+                        None の場合は大きさで制限しない
+    """
+
+    def __init__(self, maxsize=10000, maxbytes=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.hits = 0
+        self.misses = 0
+        self._results = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    @property
+    def bytes(self):
+        """ 記憶している入力と結果の大きさの合計 """
+        return self._bytes
+
+    @staticmethod
+    def fingerprint(analyzer):
+        """ 解析結果を左右する解析器の設定を文字列で返す
+
+        Args:
+            analyzer (Analyzer): 解析器
+
+        Returns:
+            str: 解析器の設定を表す文字列
+        """
+        if analyzer.daemon is None and analyzer.server is not None:
+            return repr(('socket', analyzer.server, analyzer.port, analyzer.socket_option))
+        return repr((analyzer.backend, analyzer.command))
+
+    def get(self, key):
+        """ 記憶している結果を返す
+
+        Args:
+            key (tuple): 解析器の設定と入力文字列などの組
+
+        Returns:
+            str: 解析結果。記憶していない場合は None
+        """
+        with self._lock:
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key, result):
+        """ 解析結果を記憶する
+
+        Args:
+            key (tuple): 解析器の設定と入力文字列などの組
+            result (str): 解析結果
+        """
+        size = self._size(key, result)
+        if self.maxbytes is not None and size > self.maxbytes:
+            return
+        with self._lock:
+            old = self._results.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(key, old)
+            self._results[key] = result
+            self._bytes += size
+            while (self.maxsize is not None and len(self._results) > self.maxsize) or \
+                    (self.maxbytes is not None and self._bytes > self.maxbytes):
+                old_key, old = self._results.popitem(last=False)
+                self._bytes -= self._size(old_key, old)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self._bytes = 0
+
+    @staticmethod
+    def _size(key, result):
+        # 設定を表す文字列は複数のキーで共有されるため、入力文字列と結果の大きさだけを数える
+        return sys.getsizeof(key[-1]) + sys.getsizeof(result)
+
+
+class DiskCache(object):
+    """ JUMAN/KNPの解析結果 (出力文字列) をSQLiteのファイルに記憶しておくキャッシュ
+
+    WALモードで開くため、同じファイルを複数のプロセスから同時に読み書きできる。
+    キーは解析器の設定・コマンドが報告するバージョン (-v の出力)・入力文字列の組のハッシュ値で、
+    バージョンや設定の異なる解析器の結果は区別される。
+    記憶している結果の大きさの合計が maxbytes を超えると、最近使われていないものから消す。
+
+    Args:
+        path (str): SQLiteのデータベースファイルのパス
+        maxbytes (int): 記憶する結果の大きさ (バイト) の合計の上限。None の場合は制限しない
+        check_interval (int): 大きさの合計を確かめる間隔 (記憶した結果の数)
+        timeout (float): 他のプロセスの書き込みを待つ時間 (秒)
+    """
+
+    # 結果を使った時刻を更新する間隔 (秒)。使うたびに書き込まないようにする
+    touch_interval = 3600
+
+    def __init__(self, path, maxbytes=None, check_interval=1000, timeout=30):
+        self.path = os.path.expanduser(path)
+        self.maxbytes = maxbytes
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS results '
+                         '(key TEXT PRIMARY KEY, result TEXT NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_atime ON results (atime)')
+
+    def __len__(self):
+        return self._connect().execute('SELECT COUNT(*) FROM results').fetchone()[0]
+
+    @property
+    def bytes(self):
+        """ 記憶している結果の大きさの合計 """
+        return self._connect().execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+
+    @staticmethod
+    def fingerprint(analyzer):
+        """ 解析結果を左右する解析器の設定を、コマンドが報告するバージョンと合わせて文字列で返す
+
+        Args:
+            analyzer (Analyzer): 解析器
+
+        Returns:
+            str: 解析器の設定を表す文字列
+        """
+        fingerprint = AnalysisCache.fingerprint(analyzer)
+        if analyzer.daemon is None and analyzer.server is not None:
+            return fingerprint
+        commands = analyzer.command if analyzer.backend == 'pipeline' else [analyzer.command]
+        return repr((fingerprint, [_version(command[0]) for command in commands]))
+
+    def get(self, key):
+        """ 記憶している結果を返す
+
+        Args:
+            key (tuple): 解析器の設定と入力文字列などの組
+
+        Returns:
+            str: 解析結果。記憶していない場合は None
+        """
+        digest = self._digest(key)
+        conn = self._connect()
+        row = conn.execute('SELECT result, atime FROM results WHERE key = ?', (digest,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time.time()
+        if row[1] < now - self.touch_interval:
+            with conn:
+                conn.execute('UPDATE results SET atime = ? WHERE key = ?', (now, digest))
+        return row[0]
+
+    def put(self, key, result):
+        """ 解析結果を記憶する
+
+        Args:
+            key (tuple): 解析器の設定と入力文字列などの組
+            result (str): 解析結果
+        """
+        size = len(result.encode('utf-8'))
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO results (key, result, size, atime) VALUES (?, ?, ?, ?)',
+                         (self._digest(key), result, size, time.time()))
+        with self._lock:
+            self._puts += 1
+            check = self._puts % self.check_interval == 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """ 大きさの合計が maxbytes を超えている場合、最近使われていない結果から maxbytes の9割まで消す """
+        if self.maxbytes is None:
+            return
+        total = self.bytes
+        if total <= self.maxbytes:
+            return
+        conn = self._connect()
+        excess = total - self.maxbytes * 0.9
+        keys = []
+        for digest, size in conn.execute('SELECT key, size FROM results ORDER BY atime'):
+            if excess <= 0:
+                break
+            keys.append((digest,))
+            excess -= size
+        with conn:
+            conn.executemany('DELETE FROM results WHERE key = ?', keys)
+
+    def clear(self):
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM results')
+
+    def close(self):
+        """ このスレッドの接続を閉じる """
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+
+    def _connect(self):
+        # 接続はスレッドごとに作り、fork した子プロセスでは親の接続を使わずに作り直す
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+
+
+_versions = {}
+
+
+def _version(command):
+    """ コマンドが -v で報告するバージョンを返す。取得できない場合は空文字列を返す """
+    if command not in _versions:
+        try:
+            # 終了コードが0でなくてもバージョンを出力するコマンドがあるため、終了コードは見ない
+            output = subprocess.run([command, '-v'], stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT, timeout=10).stdout
+            _versions[command] = output.decode('utf-8', 'replace').strip()
+        except (OSError, subprocess.SubprocessError):
+            _versions[command] = ''
+    return _versions[command]
@@ -0,0 +1,74 @@
+import os
+import socketserver
+import time
+
+from .analyzer import AnalyzerPool
+from .process import DaemonError, OverloadedError, recv_message, send_message
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    """ JUMAN/KNPのサブプロセスを常駐させ、Unixドメインソケット経由で複数のクライアントプロセスからの解析を受け付けるサーバー
+
+    コマンドごとに AnalyzerPool を持ち、クライアントから送られたコマンドと一致するプールで解析する。
+
+    Args:
+        path (str): Unixドメインソケットのパス
+        commands (list): 常駐させるコマンドのリスト
+        workers (int): コマンドごとに起動するサブプロセスの数
+        timeout (float): 1文あたりの解析のタイムアウト (秒)
+        spares (int): コマンドごとに予め起動しておく予備のサブプロセスの数
+        max_queue (int): コマンドごとの解析待ちの要求数の上限。超えた要求はすぐにエラーを返す
+        mode (int): ソケットファイルの権限
+    """
+
+    daemon_threads = True
+
+    def __init__(self, path, commands, workers=1, timeout=180, spares=0, max_queue=None, mode=0o600):
+        self.mode = mode
+        self.pools = {}
+        for command in commands:
+            self.pools[tuple(command)] = AnalyzerPool(list(command), workers, timeout=timeout, spares=spares,
+                                                      max_queue=max_queue)
+        if os.path.exists(path):
+            os.remove(path)
+        socketserver.ThreadingUnixStreamServer.__init__(self, path, _DaemonHandler)
+
+    def server_bind(self):
+        # 接続を受け付け始める前に権限を設定する。それまでは誰も接続できない権限でソケットを作る
+        umask = os.umask(0o777)
+        try:
+            socketserver.ThreadingUnixStreamServer.server_bind(self)
+        finally:
+            os.umask(umask)
+        os.chmod(self.server_address, self.mode)
+
+    def server_close(self):
+        socketserver.ThreadingUnixStreamServer.server_close(self)
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+    def handle_message(self, message):
+        pool = self.pools.get(tuple(message['command']))
+        if pool is None:
+            raise DaemonError('pyknp-server has no workers for command: %s' % ' '.join(message['command']))
+        deadline = None
+        if message.get('timeout') is not None:
+            deadline = time.monotonic() + message['timeout']
+        return pool.query_batch(message['inputs'], pattern=message['pattern'], split=message.get('split', True),
+                                priority=message.get('priority', 'batch'), deadline=deadline)
+
+
+class _DaemonHandler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            message = recv_message(self.request)
+            if message is None:
+                return
+            try:
+                response = {'results': self.server.handle_message(message)}
+            except OverloadedError as e:
+                response = {'error': str(e), 'overloaded': True}
+            except Exception as e:
+                response = {'error': '%s: %s' % (e.__class__.__name__, e)}
+            send_message(self.request, response)
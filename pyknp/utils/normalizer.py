@@ -0,0 +1,150 @@
+import unicodedata
+
+# 直前の文字と合わせて1文字として扱う濁点・半濁点 (結合文字でないもの)
+_VOICED_MARKS = {
+    '\u309b': '\u3099',  # ゛
+    '\u309c': '\u309a',  # ゜
+    '\uff9e': '\u3099',  # ﾞ
+    '\uff9f': '\u309a',  # ﾟ
+}
+
+
+class NormalizedText(object):
+    """ 正規化した文字列と、その各文字の元の文字列での位置を保持するクラス
+
+    Args:
+        text (str): 正規化した文字列
+        original (str): 元の文字列
+        spans (list): 正規化した文字列の各文字に対応する元の文字列の範囲 (開始位置, 終了位置) のリスト
+    """
+
+    def __init__(self, text, original, spans):
+        self.text = text
+        self.original = original
+        self.spans = spans
+
+    def original_span(self, start, end):
+        """ 正規化した文字列の範囲に対応する元の文字列の範囲を返す
+
+        Args:
+            start (int): 正規化した文字列での開始位置
+            end (int): 正規化した文字列での終了位置 (この位置の文字は含まない)
+
+        Returns:
+            tuple: 元の文字列での (開始位置, 終了位置)
+        """
+        if start >= end:
+            position = self.spans[start][0] if start < len(self.spans) else len(self.original)
+            return position, position
+        return self.spans[start][0], self.spans[end - 1][1]
+
+
+class Normalizer(object):
+    """ JUMAN/KNPに渡す前に入力文字列を正規化するクラス
+
+    幅や空白だけが異なる入力を同じ文字列にそろえ、キャッシュのヒット率を上げる。
+    正規化は「基底文字とそれに続く結合文字・濁点・半濁点」のまとまりごとに行うため、
+    正規化した文字列の各文字について元の文字列での位置がわかる。
+    まとまりごとの変換を変える場合は normalize_cluster を上書きする。
+    JUMAN/KNPは1行を1文として扱うため、改行は正規化の際に取り除く。
+
+    Args:
+        nfkc (bool): NFKC正規化を行うか (半角カナ・濁点の合成なども含む)
+        collapse_whitespace (bool): 連続する空白を1つにまとめ、先頭と末尾の空白を取り除くか
+        fullwidth (bool): ASCIIの英数字・記号・空白を全角に変換するか
+    """
+
+    def __init__(self, nfkc=True, collapse_whitespace=True, fullwidth=True):
+        self.nfkc = nfkc
+        self.collapse_whitespace = collapse_whitespace
+        self.fullwidth = fullwidth
+
+    def __call__(self, text):
+        """ 文字列を正規化する
+
+        Args:
+            text (str): 元の文字列
+
+        Returns:
+            NormalizedText: 正規化した文字列と元の文字列での位置
+        """
+        chars = []
+        spans = []
+        for start, end in self._clusters(text):
+            for char in self.normalize_cluster(text[start:end]):
+                if char == '\n':
+                    continue
+                chars.append(char)
+                spans.append((start, end))
+        if self.collapse_whitespace:
+            chars, spans = self._collapse_whitespace(chars, spans)
+        if self.fullwidth:
+            chars = [_to_fullwidth(char) for char in chars]
+        return NormalizedText(''.join(chars), text, spans)
+
+    def normalize_cluster(self, cluster):
+        """ 基底文字とそれに続く結合文字・濁点・半濁点のまとまりを正規化する
+
+        Args:
+            cluster (str): 文字のまとまり
+
+        Returns:
+            str: 正規化した文字列
+        """
+        if not self.nfkc:
+            return cluster
+        if len(cluster) > 1:
+            # 全角・半角の濁点は結合文字に置き換えてから合成する (「か゛」→「が」)
+            cluster = cluster[0] + ''.join(_VOICED_MARKS.get(char, char) for char in cluster[1:])
+        return unicodedata.normalize('NFKC', cluster)
+
+    @staticmethod
+    def _clusters(text):
+        start = 0
+        for i in range(1, len(text) + 1):
+            if i == len(text) or not (unicodedata.combining(text[i]) or text[i] in _VOICED_MARKS):
+                yield start, i
+                start = i
+
+    @staticmethod
+    def _collapse_whitespace(chars, spans):
+        collapsed_chars = []
+        collapsed_spans = []
+        for char, span in zip(chars, spans):
+            if char.isspace():
+                if not collapsed_chars:
+                    continue
+                if collapsed_chars[-1] == ' ':
+                    collapsed_spans[-1] = (collapsed_spans[-1][0], span[1])
+                    continue
+                char = ' '
+            collapsed_chars.append(char)
+            collapsed_spans.append(span)
+        if collapsed_chars and collapsed_chars[-1] == ' ':
+            collapsed_chars.pop()
+            collapsed_spans.pop()
+        return collapsed_chars, collapsed_spans
+
+
+def _to_fullwidth(char):
+    if '!' <= char <= '~':
+        return chr(ord(char) + 0xfee0)
+    if char == ' ':
+        return '\u3000'
+    return char
+
+
+def normalize(normalizer, text):
+    """ normalizer が指定されていれば文字列を正規化する
+
+    Args:
+        normalizer (Normalizer): 正規化に用いる関数。None の場合は正規化しない
+        text (str): 元の文字列
+
+    Returns:
+        tuple: (解析に用いる文字列, NormalizedText または None)
+    """
+    if normalizer is None:
+        return text, None
+    normalized = normalizer(text)
+    return normalized.text, normalized
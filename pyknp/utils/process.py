@@ -1,44 +1,196 @@
+import asyncio
+import json
 import os
 import re
-import signal
+import selectors
 import socket
+import struct
 import subprocess
 import sys
+import threading
+import time
 
 import six
 
+try:
+    import resource
+except ImportError:
+    # Windows
+    resource = None
+
+
+class ProcessTerminatedError(subprocess.SubprocessError):
+    """ 解析結果を読み出している途中でサブプロセスが終了したことを表す例外 """
+
+    def __init__(self, cmd, output=''):
+        super(ProcessTerminatedError, self).__init__(cmd, output)
+        self.cmd = cmd
+        self.output = output
+
+    def __str__(self):
+        return "Command '%s' terminated before printing the end of output" % (self.cmd,)
+
+
+class AnalysisTimeoutError(subprocess.TimeoutExpired):
+    """ 1つの入力の解析がタイムアウトしたことを表す例外
+
+    Attributes:
+        input (str): 解析中だった入力
+        exceeded_timeout (bool): 1文あたりのタイムアウトを超えたか。False の場合は要求の締め切りを過ぎた
+    """
+
+    def __init__(self, cmd, timeout, input_str, exceeded_timeout=True):
+        super(AnalysisTimeoutError, self).__init__(cmd, timeout)
+        self.input = input_str
+        self.exceeded_timeout = exceeded_timeout
+
+
+class QuarantinedError(Exception):
+    """ 過去に解析がタイムアウトした入力のため、解析せずに断ったことを表す例外
+
+    Attributes:
+        inputs (list): 断った入力のリスト
+    """
+
+    def __init__(self, inputs):
+        super(QuarantinedError, self).__init__('%d input(s) are quarantined after timing out' % len(inputs))
+        self.inputs = inputs
+
+
+class OverloadedError(Exception):
+    """ 待ち行列が上限に達していたり、締め切りまでに解析を始められなかったりしたため、解析要求を断ったことを表す例外 """
+
+
+def _find_terminator(buf, regex, start=0):
+    """ buf[start:] の改行で終わる行の中から終端記号にマッチする行を探す
+
+    Returns:
+        tuple: (終端記号の行の開始位置, 次の行の開始位置)。見つからなければ None
+    """
+    end = buf.rfind(b'\n', start)
+    if end < 0:
+        return None
+    match = regex.search(buf, start, end)
+    if match is None:
+        return None
+    line_start = buf.rfind(b'\n', 0, match.start()) + 1
+    line_end = buf.find(b'\n', match.end())
+    return line_start, line_end + 1
+
+
+def _read_until(buf, pattern, fill):
+    """ 終端記号の行が現れるまで fill で buf に読み込み、その手前までを文字列として返す
+
+    完結した行は一度だけ走査する。終端記号の行より後ろは buf に残す。
+    """
+    regex = re.compile(pattern.encode('utf-8'), re.MULTILINE)
+    start = 0
+    while True:
+        found = _find_terminator(buf, regex, start)
+        if found is not None:
+            result = bytes(buf[:found[0]])
+            del buf[:found[1]]
+            return result.decode('utf-8')
+        start = buf.rfind(b'\n') + 1
+        fill()
+
 
 class Socket(object):
+    """ JUMAN/KNPのサーバーと通信して解析を行うクラス
 
-    def __init__(self, hostname, port, option=None):
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((hostname, port))
-        except:
-            raise
-        if option is not None:
-            self.sock.send(option)
-        data = ""
-        while "OK" not in data:
-            data = self.sock.recv(1024)
+    接続が切れていた場合は1度だけ再接続して解析をやり直す。
+
+    Args:
+        hostname (str): サーバーのホスト名。'/' を含む場合はUnixドメインソケットのパスとみなす
+        port (int): サーバーのポート番号
+        option (str): 接続時にサーバーに送るオプション
+        timeout (float): 1文あたりの解析のタイムアウト (秒)
+    """
+
+    bufsize = 1 << 16
+
+    def __init__(self, hostname, port, option=None, timeout=None):
+        self.hostname = hostname
+        self.port = port
+        self.option = option
+        self.timeout = timeout
+        self.sock = None
+        self._connect()
 
     def __del__(self):
+        self.close()
+
+    def close(self):
         if self.sock:
             self.sock.close()
+            self.sock = None
+
+    def is_alive(self):
+        return self.sock is not None
 
     def query(self, sentence, pattern):
         assert isinstance(sentence, six.text_type)
         sentence = sentence.strip() + '\n'  # ensure sentence ends with '\n'
+        if self.sock is None:
+            self._connect()
+        try:
+            return self._query(sentence, pattern)
+        except socket.timeout:
+            self.close()
+            raise
+        except socket.error:
+            # サーバー側で接続が閉じられていた場合に備えて、つなぎ直して1度だけやり直す
+            self.close()
+            self._connect()
+            return self._query(sentence, pattern)
+
+    def query_batch(self, sentences, pattern):
+        return [self.query(sentence, pattern) for sentence in sentences]
+
+    def _connect(self):
+        if '/' in self.hostname:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.hostname)
+        else:
+            sock = socket.create_connection((self.hostname, self.port), self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        self.sock = sock
+        self._buffer = bytearray()
+        try:
+            if self.option is not None:
+                self.sock.sendall(self.option.encode('utf-8'))
+            _read_until(self._buffer, r'OK', self._recv)
+        except Exception:
+            self.close()
+            raise
+
+    def _query(self, sentence, pattern):
         self.sock.sendall(sentence.encode('utf-8'))
-        data = self.sock.recv(1024)
-        recv = data
-        while not re.search(pattern, recv):
-            data = self.sock.recv(1024)
-            recv = "%s%s" % (recv, data)
-        return recv.strip().decode('utf-8')
+        return _read_until(self._buffer, pattern, self._recv)
+
+    def _recv(self):
+        data = self.sock.recv(self.bufsize)
+        if not data:
+            raise socket.error('Connection closed by the server')
+        self._buffer += data
+
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
 
 
 class Subprocess(object):
+    """ サブプロセスと通信して解析を行うクラス
+
+    出力の読み出しは selector で待ち合わせるため、タイムアウトはどのスレッドからでも秒未満の精度で働く。
+
+    Args:
+        command (list): サブプロセスに渡すコマンド
+        timeout (float): 1文あたりの解析のタイムアウト (秒)
+    """
+
+    bufsize = 1 << 16
 
     def __init__(self, command, timeout=180):
         subproc_args = {'stdin': subprocess.PIPE, 'stdout': subprocess.PIPE,
@@ -46,17 +198,40 @@ class Subprocess(object):
         try:
             env = os.environ.copy()
             self.process = subprocess.Popen(command, env=env, **subproc_args)
+            self.processes = [self.process]
             self.process_command = command
             self.process_timeout = timeout
         except OSError:
             raise
+        self._init_pipes(self.process.stdin, self.process.stdout)
+
+    def _init_pipes(self, stdin, stdout):
+        # fork した子プロセスが親のサブプロセスを終了させないよう、起動したプロセスを記録する
+        self._pid = os.getpid()
+        # これまでに解析した文の数
+        self.queries = 0
+        self.cpus = None
+        self.stdin = stdin
+        self._stdout_fd = stdout.fileno()
+        self._buffer = bytearray()
+        if sys.platform == "win32":
+            # Windows ではパイプを select できないため、タイムアウトなしで読み出す
+            self._selector = None
+        else:
+            self._selector = selectors.DefaultSelector()
+            self._selector.register(self._stdout_fd, selectors.EVENT_READ)
 
     def __del__(self):
-        self.process.stdin.close()
-        self.process.stdout.close()
         try:
-            self.process.kill()
-            self.process.wait()
+            if self._selector is not None:
+                self._selector.close()
+            self.stdin.close()
+            for process in self.processes:
+                if process.stdout:
+                    process.stdout.close()
+                if self._pid == os.getpid():
+                    process.kill()
+                    process.wait()
         except OSError:
             pass
         except TypeError:
@@ -64,46 +239,442 @@ class Subprocess(object):
         except AttributeError:
             pass
 
-    def query(self, sentence, pattern):
+    def is_alive(self):
+        """ サブプロセスがすべて動作中かどうか """
+        return all(process.poll() is None for process in self.processes)
+
+    def kill(self):
+        """ サブプロセスを直ちに終了させる """
+        if self._pid != os.getpid():
+            return
+        for process in self.processes:
+            try:
+                process.kill()
+            except OSError:
+                pass
+
+    def set_affinity(self, cpus):
+        """ サブプロセスを実行するCPUコアを cpus (コア番号の集合) に限る """
+        for process in self.processes:
+            os.sched_setaffinity(process.pid, cpus)
+        self.cpus = cpus
+
+    def set_limits(self, memory_limit=None, nice=None):
+        """ サブプロセスのアドレス空間の上限 (RLIMIT_AS, バイト) とnice値を設定する
+
+        preexec_fn はスレッドから起動する場合に安全でないため、起動後に親プロセスから設定する。
+        """
+        for process in self.processes:
+            if memory_limit is not None:
+                resource.prlimit(process.pid, resource.RLIMIT_AS, (memory_limit, memory_limit))
+            if nice is not None:
+                os.setpriority(os.PRIO_PROCESS, process.pid, nice)
+
+    def rss(self):
+        """ サブプロセスの常駐メモリ (RSS) の合計をバイト数で返す。/proc を読めない環境では None """
+        total = 0
+        for process in self.processes:
+            try:
+                with open('/proc/%d/statm' % process.pid) as f:
+                    total += int(f.read().split()[1]) * _PAGE_SIZE
+            except (IOError, OSError, IndexError, ValueError):
+                return None
+        return total
+
+    def query(self, sentence, pattern, deadline=None):
         assert isinstance(sentence, six.text_type)
-        sentence = sentence.strip() + '\n'  # ensure sentence ends with '\n'
+        self.queries += 1
+        self._write(sentence)
+        self.stdin.flush()
+        return self._read_result(sentence, pattern, deadline)
 
-        def alarm_handler(signum, frame):
-            raise subprocess.TimeoutExpired(self.process_command, self.process_timeout)
+    def query_batch(self, sentences, pattern, deadline=None):
+        """ 複数の文をまとめて解析する
+
+        書き込みを別スレッドで行い、サブプロセスに常に複数の文を渡した状態で出力を読み出す。
+        パイプのバッファが一杯になっても書き込みと読み出しが互いを待つことはない。
+
+        Args:
+            sentences (list): 文を表す文字列のリスト
+            pattern (str): 出力の終端記号
+            deadline (float): 解析全体の締め切り (time.monotonic() の値)
+
+        Returns:
+            list: 各文の解析結果 (入力と同じ順序)
+        """
+        sentences = list(sentences)
+        for sentence in sentences:
+            assert isinstance(sentence, six.text_type)
+        self.queries += len(sentences)
+        errors = []
+
+        def writer():
+            try:
+                for sentence in sentences:
+                    self._write(sentence)
+                self.stdin.flush()
+            except (IOError, OSError, ValueError) as e:
+                errors.append(e)
 
-        signal.signal(signal.SIGALRM, alarm_handler)
-        signal.alarm(self.process_timeout)
-        result = ''
+        thread = threading.Thread(target=writer)
+        thread.daemon = True
+        thread.start()
+        results = []
+        for sentence in sentences:
+            results.append(self._read_result(sentence, pattern, deadline))
+        thread.join()
+        if errors:
+            raise errors[0]
+        return results
+
+    def _deadline(self):
+        if self.process_timeout is None:
+            return None
+        return time.monotonic() + self.process_timeout
+
+    def _read_result(self, sentence, pattern, deadline=None):
+        """ sentence の解析結果を、1文あたりのタイムアウトと deadline の早い方までに読み出す """
+        limit = self._deadline()
+        exceeded_timeout = True
+        if deadline is not None and (limit is None or deadline < limit):
+            limit = deadline
+            exceeded_timeout = False
         try:
-            self.process.stdin.write(sentence.encode('utf-8'))
-            self.process.stdin.flush()
-            while True:
-                if self.process.poll() is not None:
-                    break
-                line = self.process.stdout.readline().decode('utf-8').rstrip()
-                if re.search(pattern, line):
-                    break
-                result += line + '\n'
-        finally:
-            signal.alarm(0)
-        self.process.stdout.flush()
-        return result
+            return self._read(pattern, limit)
+        except subprocess.TimeoutExpired:
+            raise AnalysisTimeoutError(self.process_command, self.process_timeout, sentence, exceeded_timeout)
+
+    def _write(self, sentence):
+        sentence = sentence.strip() + '\n'  # ensure sentence ends with '\n'
+        self.stdin.write(sentence.encode('utf-8'))
+
+    def _read(self, pattern, deadline):
+        return _read_until(self._buffer, pattern, lambda: self._fill(deadline))
+
+    def _fill(self, deadline):
+        """ サブプロセスの出力をバッファに読み込む """
+        if self._selector is not None and deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._selector.select(remaining):
+                raise subprocess.TimeoutExpired(self.process_command, self.process_timeout)
+        data = os.read(self._stdout_fd, self.bufsize)
+        if not data:
+            output = bytes(self._buffer).decode('utf-8', 'replace')
+            del self._buffer[:]
+            raise ProcessTerminatedError(self.process_command, output)
+        self._buffer += data
+
+
+class SubprocessPipeline(Subprocess):
+    """ 複数のコマンドをOSのパイプでつないで実行し、先頭のコマンドに入力を渡して末尾のコマンドの出力を読み出すクラス
+
+    途中のコマンドの出力はPythonを経由せず、直接次のコマンドに渡される。
+
+    Args:
+        commands (list): コマンドのリスト。各コマンドの標準出力が次のコマンドの標準入力につながる
+        timeout (float): 1文あたりの解析のタイムアウト (秒)
+    """
+
+    def __init__(self, commands, timeout=180):
+        close_fds = sys.platform != "win32"
+        env = os.environ.copy()
+        self.processes = []
+        stdin = subprocess.PIPE
+        for command in commands:
+            process = subprocess.Popen(command, env=env, stdin=stdin, stdout=subprocess.PIPE, cwd='.',
+                                       close_fds=close_fds)
+            if stdin is not subprocess.PIPE:
+                # 前のコマンドの出力は次のコマンドだけが読むようにする
+                stdin.close()
+            stdin = process.stdout
+            self.processes.append(process)
+        self.process = self.processes[-1]
+        self.process_command = commands
+        self.process_timeout = timeout
+        self._init_pipes(self.processes[0].stdin, self.process.stdout)
 
 
 class SubprocessThreadSafe(object):
+    """ 複数のスレッドから利用できるサブプロセス
 
-    def __init__(self, command, timeout=180):
-        self.subproc_args = {'stdout': subprocess.PIPE, 'timeout': timeout, 'cwd': '.',
-                             'close_fds': sys.platform != "win32"}
+    起動したプロセスは解析のたびに使い回す。解析はロックによって1つずつ行われ、
+    タイムアウトした場合やプロセスが終了していた場合は次の解析時にプロセスを起動し直す。
+
+    Args:
+        command (list): サブプロセスに渡すコマンド
+        timeout (float): 1文あたりの解析のタイムアウト (秒)
+        subprocess_class (type): 起動に用いるクラス (Subprocess または SubprocessPipeline)
+    """
+
+    def __init__(self, command, timeout=180, subprocess_class=Subprocess):
         self.command = command
+        self.timeout = timeout
+        self.subprocess_class = subprocess_class
+        self._lock = threading.Lock()
+        self._subprocess = None
 
-    def query(self, sentence, pattern):
+    def query(self, sentence, pattern, deadline=None):
         assert isinstance(sentence, six.text_type)
-        env = os.environ.copy()
-        proc = subprocess.run(self.command, input=(sentence + "\n").encode(), env=env, check=True, **self.subproc_args)
-        result = ""
-        for line in proc.stdout.decode().split("\n"):
-            if re.search(pattern, line):
-                break
-            result += line + '\n'
-        return result
+        return self._call(lambda proc: proc.query(sentence, pattern, deadline=deadline))
+
+    def query_batch(self, sentences, pattern, deadline=None):
+        return self._call(lambda proc: proc.query_batch(sentences, pattern, deadline=deadline))
+
+    def _call(self, func):
+        with self._lock:
+            if self._subprocess is None or not self._subprocess.is_alive():
+                self._subprocess = self.subprocess_class(self.command, timeout=self.timeout)
+            try:
+                return func(self._subprocess)
+            except BaseException:
+                # 出力を読み切れていない可能性があるため、次の解析ではプロセスを起動し直す
+                self._subprocess.kill()
+                self._subprocess = None
+                raise
+
+
+_HEADER = struct.Struct('>I')
+
+
+class DaemonError(Exception):
+    """ pyknp-server での解析が失敗したことを表す例外 """
+
+
+def send_message(sock, message):
+    """ 長さ (4バイト) を前置したJSONメッセージを送る """
+    data = json.dumps(message, ensure_ascii=False).encode('utf-8')
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock):
+    """ send_message で送られたメッセージを受け取る。接続が閉じられていれば None を返す """
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        raise socket.error('Connection closed in the middle of a message')
+    return json.loads(data.decode('utf-8'))
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        data = sock.recv(size - len(buf))
+        if not data:
+            return None
+        buf += data
+    return bytes(buf)
+
+
+class DaemonClient(object):
+    """ pyknp-server に解析を依頼するクライアント
+
+    スレッドごとに接続を持つため、複数のスレッドから同時に利用できる。
+    応答が 1文あたりのタイムアウト×文の数 (締め切りがあればその残り時間まで) を過ぎても届かない場合は、
+    接続を切って AnalysisTimeoutError (締め切りを過ぎた場合は OverloadedError) を送出する。
+
+    Args:
+        path (str): pyknp-server のUnixドメインソケットのパス
+        command (list): 解析に用いるコマンド (pyknp-server で常駐させているものと一致する必要がある)
+        timeout (float): 1文あたりの解析のタイムアウト (秒)。None の場合は応答を待ち続ける
+    """
+
+    # サーバー側のタイムアウトや締め切りによるエラーの応答が先に届くように、応答を待つ時間に足す余裕 (秒)
+    grace = 1.0
+
+    def __init__(self, path, command, timeout=None):
+        self.path = path
+        self.command = command
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def query(self, sentence, pattern, priority='interactive', deadline=None):
+        return self.query_batch([sentence], pattern, priority=priority, deadline=deadline)[0]
+
+    def query_batch(self, sentences, pattern, split=True, priority='batch', deadline=None):
+        message = {'command': self.command, 'inputs': list(sentences), 'pattern': pattern, 'split': split,
+                   'priority': priority}
+        wait = None if self.timeout is None else self.timeout * max(len(message['inputs']), 1)
+        if deadline is not None:
+            # 締め切りは残り時間に直して送る
+            message['timeout'] = deadline - time.monotonic()
+            wait = message['timeout'] if wait is None else min(wait, message['timeout'])
+        try:
+            sock = self._connection()
+            sock.settimeout(None if wait is None else max(wait, 0) + self.grace)
+            send_message(sock, message)
+            response = recv_message(sock)
+            if response is None:
+                raise socket.error('Connection closed by pyknp-server')
+        except socket.timeout:
+            self._close()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise OverloadedError('The deadline has passed while waiting for pyknp-server')
+            raise AnalysisTimeoutError(self.command, self.timeout, '\n'.join(message['inputs']),
+                                       exceeded_timeout=False)
+        except (socket.error, ValueError):
+            self._close()
+            raise
+        if response.get('overloaded'):
+            raise OverloadedError(response['error'])
+        if 'error' in response:
+            raise DaemonError(response['error'])
+        return response['results']
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._local.sock = sock
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+        return sock
+
+    def _close(self):
+        # 応答を読み切れていない接続は使い回さない
+        sock = getattr(self._local, 'sock', None)
+        self._local.sock = None
+        if sock is not None:
+            sock.close()
+
+
+class AsyncSubprocess(object):
+    """ asyncio のイベントループ上でサブプロセスと通信するクラス
+
+    Args:
+        command (list): サブプロセスに渡すコマンド
+        timeout (int): 1文あたりの解析のタイムアウト (秒)
+    """
+
+    bufsize = 1 << 16
+
+    def __init__(self, command, timeout=180):
+        self.process = None
+        self.process_command = command
+        self.process_timeout = timeout
+        self._buffer = bytearray()
+        self._lock = None
+
+    def __del__(self):
+        if self.process is not None and self.process.returncode is None:
+            try:
+                self.process.kill()
+            except (OSError, RuntimeError):
+                pass
+
+    async def query(self, sentence, pattern):
+        assert isinstance(sentence, six.text_type)
+        async with self._get_lock():
+            await self._start()
+            try:
+                self._write(sentence)
+                await self.process.stdin.drain()
+                return await self._read_until_timeout(pattern)
+            except BaseException:
+                # 出力の途中で中断した場合はプロセスごと破棄する
+                self._kill()
+                raise
+
+    async def query_stream(self, sentences, pattern):
+        """ 入力を次々にサブプロセスに渡し、解析結果を入力と同じ順序で返す
+
+        Args:
+            sentences: 文を表す文字列の (非同期) イテラブル
+            pattern (str): 出力の終端記号
+
+        Yields:
+            str: 各文の解析結果
+        """
+        async with self._get_lock():
+            await self._start()
+            pending = asyncio.Queue()
+
+            async def writer():
+                try:
+                    async for sentence in to_aiter(sentences):
+                        assert isinstance(sentence, six.text_type)
+                        self._write(sentence)
+                        await self.process.stdin.drain()
+                        await pending.put(True)
+                finally:
+                    await pending.put(False)
+
+            task = asyncio.ensure_future(writer())
+            completed = False
+            try:
+                while await pending.get():
+                    yield await self._read_until_timeout(pattern)
+                await task
+                completed = True
+            finally:
+                if not completed:
+                    # 読み出されていない出力が残っているため、プロセスごと破棄する
+                    task.cancel()
+                    self._kill()
+
+    async def close(self):
+        """ サブプロセスを終了させる。イベントループを閉じる前に呼ぶ """
+        async with self._get_lock():
+            if self.process is not None:
+                process = self.process
+                self.process = None
+                process.stdin.close()
+                await process.wait()
+
+    async def _start(self):
+        if self.process is None:
+            del self._buffer[:]
+            self.process = await asyncio.create_subprocess_exec(
+                *self.process_command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, cwd='.',
+                env=os.environ.copy())
+
+    def _get_lock(self):
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    def _kill(self):
+        if self.process is not None:
+            try:
+                self.process.kill()
+            except OSError:
+                pass
+            self.process = None
+
+    def _write(self, sentence):
+        sentence = sentence.strip() + '\n'  # ensure sentence ends with '\n'
+        self.process.stdin.write(sentence.encode('utf-8'))
+
+    async def _read_until_timeout(self, pattern):
+        try:
+            return await asyncio.wait_for(self._read(pattern), self.process_timeout)
+        except asyncio.TimeoutError:
+            raise subprocess.TimeoutExpired(self.process_command, self.process_timeout)
+
+    async def _read(self, pattern):
+        regex = re.compile(pattern.encode('utf-8'), re.MULTILINE)
+        start = 0
+        while True:
+            found = _find_terminator(self._buffer, regex, start)
+            if found is not None:
+                result = bytes(self._buffer[:found[0]])
+                del self._buffer[:found[1]]
+                return result.decode('utf-8')
+            start = self._buffer.rfind(b'\n') + 1
+            data = await self.process.stdout.read(self.bufsize)
+            if not data:
+                output = bytes(self._buffer).decode('utf-8', 'replace')
+                del self._buffer[:]
+                raise ProcessTerminatedError(self.process_command, output)
+            self._buffer += data
+
+
+async def to_aiter(iterable):
+    """ 通常のイテラブルと非同期イテラブルの両方を非同期イテラブルとして扱う """
+    if hasattr(iterable, '__aiter__'):
+        async for item in iterable:
+            yield item
+    else:
+        for item in iterable:
+            yield item
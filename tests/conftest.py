@@ -12,3 +12,13 @@ def knp():
 @pytest.fixture
 def knp_multithread():
     return pyknp.KNP(multithreading=True)
+
+
+@pytest.fixture
+def knp_workers():
+    return pyknp.KNP(workers=2)
+
+
+@pytest.fixture
+def knp_pipeline():
+    return pyknp.KNP(pipeline=True)
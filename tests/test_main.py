@@ -1,6 +1,14 @@
+import asyncio
 import concurrent.futures
+import os
+import sys
+import threading
 import time
 
+import pytest
+
+import pyknp
+
 
 def _task(knp):
     text = "今日はいい天気だった"
@@ -18,3 +26,539 @@ def test_knp_multithread(knp_multithread):
         while future.running():
             time.sleep(0.1)
         future.result()
+
+
+def test_knp_batch(knp):
+    texts = ["今日はいい天気だった", "赤い花が咲いた。", "今日はいい天気だった"]
+    blists = knp.parse_batch(texts)
+    assert len(blists) == len(texts)
+    for text, blist in zip(texts, blists):
+        assert text == "".join(b.midasi for b in blist)
+
+
+def test_knp_workers(knp_workers):
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(_task, knp_workers) for _ in range(8)]
+        for future in futures:
+            future.result()
+
+
+def test_async_knp():
+    texts = ["今日はいい天気だった", "赤い花が咲いた。"]
+
+    async def main():
+        knp = pyknp.AsyncKNP()
+        blist = await knp.parse(texts[0])
+        assert texts[0] == "".join(b.midasi for b in blist)
+        blists = [blist async for blist in knp.parse_stream(texts)]
+        assert texts == ["".join(b.midasi for b in blist) for blist in blists]
+        await knp.close()
+
+    asyncio.run(main())
+
+
+def test_knp_parse_iter(knp, knp_pipeline):
+    texts = ["今日はいい天気だった", "明日は雨", "晴れ"] * 10
+    for k in (knp, knp_pipeline):
+        blists = k.parse_iter(iter(texts), queue_size=4)
+        assert texts == ["".join(b.midasi for b in blist) for blist in blists]
+    # 途中で打ち切っても次の解析に影響しない
+    for blist in knp.parse_iter(texts, queue_size=2):
+        break
+    _task(knp)
+
+
+def test_knp_pipeline(knp_pipeline):
+    _task(knp_pipeline)
+    assert len(knp_pipeline.parse_batch(["今日はいい天気だった"] * 3)) == 3
+
+
+def test_knp_restart():
+    knp = pyknp.KNP(workers=1, spares=1)
+    _task(knp)
+    for process in knp.analyzer._processes:
+        process.process.kill()
+        process.process.wait()
+    _task(knp)
+
+
+def test_juman_priority():
+    juman = pyknp.Juman(workers=1, spares=1)
+    pool = juman.analyzer
+    order = []
+    acquire = pool._acquire
+
+    def _acquire(priority="interactive", *args):
+        index = acquire(priority, *args)
+        order.append(priority)
+        return index
+
+    # 唯一のプロセスを塞いでおき、後から来た interactive の要求が先に割り当てられることを確かめる
+    index = acquire()
+    pool._acquire = _acquire
+    batch = threading.Thread(target=juman.analysis_batch, args=(["明日は雨"],))
+    batch.start()
+    time.sleep(0.2)
+    interactive = threading.Thread(target=juman.analysis, args=("今日は晴れ",))
+    interactive.start()
+    time.sleep(0.2)
+    pool._release(index)
+    batch.join()
+    interactive.join()
+    assert order == ["interactive", "batch"]
+
+
+def test_juman_coalesce():
+    juman = pyknp.Juman(workers=2, coalesce=True)
+    pool = juman.analyzer
+    calls = []
+    acquire = pool._acquire
+
+    def _acquire(*args):
+        calls.append(args)
+        return acquire(*args)
+
+    # 唯一のプロセスを塞いでおき、同じ文の要求が1度だけ解析されることを確かめる
+    indexes = [acquire(), acquire()]
+    pool._acquire = _acquire
+    with concurrent.futures.ThreadPoolExecutor(3) as executor:
+        futures = [executor.submit(juman.analysis, "今日は晴れ") for _ in range(3)]
+        time.sleep(0.2)
+        for index in indexes:
+            pool._release(index)
+        results = [future.result() for future in futures]
+    assert len(calls) == 1
+    assert len({id(result) for result in results}) == 3
+    assert all(result.spec() == results[0].spec() for result in results)
+    # まとめて解析する場合は重複した入力を1度だけ解析する
+    batches = []
+    query_batch = pool._query_batch
+
+    def _query_batch(input_strs, *args):
+        batches.append(input_strs)
+        return query_batch(input_strs, *args)
+
+    pool._query_batch = _query_batch
+    results = juman.analysis_batch(["雨", "晴れ", "雨"])
+    assert batches == [["雨", "晴れ"]]
+    assert [mlist.spec() for mlist in results] == [juman.analysis(s).spec() for s in ["雨", "晴れ", "雨"]]
+
+
+def test_knp_cache():
+    cache = pyknp.utils.AnalysisCache(maxsize=4)
+    knp = pyknp.KNP(cache=cache)
+    result = knp.parse("今日は晴れ")
+    hits = cache.hits
+    again = knp.parse("今日は晴れ")
+    # JUMANとKNPの結果がそれぞれ記憶されていて、どちらも解析し直さない
+    assert cache.hits == hits + 2
+    assert again is not result
+    assert again.spec() == result.spec()
+    # オプションの異なるKNPとは結果を共有しない
+    other = pyknp.KNP(option="-tab -dpnd", cache=cache)
+    other.parse("今日は晴れ")
+    assert cache.hits == hits + 3
+    for sentence in ["雨", "雪", "曇り"]:
+        knp.parse(sentence)
+    assert len(cache) == 4
+
+    cache = pyknp.utils.AnalysisCache(maxsize=None, maxbytes=1000)
+    juman = pyknp.Juman(cache=cache)
+    juman.analysis_batch(["今日は晴れ", "明日は雨"])
+    assert len(cache) == 2
+    assert [m.spec() for m in juman.analysis_batch(["明日は雨", "雪"])] == \
+        [juman.analysis(s).spec() for s in ["明日は雨", "雪"]]
+    assert cache.bytes <= 1000
+    assert cache.hits == 3
+
+
+def test_knp_disk_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    result = pyknp.KNP(cache=pyknp.utils.DiskCache(path)).parse("今日は晴れ")
+    # 別のプロセスを想定して開き直しても、記憶した結果を使う
+    cache = pyknp.utils.DiskCache(path)
+    knp = pyknp.KNP(cache=cache)
+    # コマンドのバージョンは解析の前に取得しておく
+    assert repr([pyknp.utils.cache._version("knp")]) in knp.analyzer._cache_fingerprint
+    assert pyknp.utils.cache._versions["knp"]
+    again = knp.parse("今日は晴れ")
+    assert cache.hits == 2 and cache.misses == 0
+    assert again.spec() == result.spec()
+    assert len(cache) == 2
+
+    cache = pyknp.utils.DiskCache(path, maxbytes=cache.bytes + 100, check_interval=1)
+    juman = pyknp.Juman(cache=cache)
+    for sentence in ["雨", "雪", "曇り", "晴れのち雨"]:
+        juman.analysis(sentence)
+    assert cache.bytes <= cache.maxbytes
+
+
+def test_knp_shared_juman():
+    juman = pyknp.Juman(cache=True)
+    knp = pyknp.KNP(juman=juman)
+    knp_dpnd = pyknp.KNP(option="-tab -dpnd", juman=juman, pipeline=True)
+    assert knp_dpnd.juman is juman and knp_dpnd.pipeline_analyzer is None
+    result = knp.parse("今日は晴れ")
+    result_dpnd = knp_dpnd.parse("今日は晴れ")
+    # 形態素解析は最初の1度だけ行う
+    assert len(juman.cache) == 1 and juman.cache.hits == 1
+    assert [m.midasi for m in result.mrph_list()] == [m.midasi for m in result_dpnd.mrph_list()]
+
+
+def test_normalizer():
+    normalizer = pyknp.utils.Normalizer()
+    normalized = normalizer(" ｶﾞｰﾄﾞ  abc　１２３ か゛ ")
+    assert normalized.text == "ガード　ａｂｃ　１２３　が"
+    # 濁点を合成した文字や、まとめた空白は元の文字列の複数の文字に対応する
+    assert normalized.spans[:2] == [(1, 3), (3, 4)]
+    assert normalized.original_span(4, 7) == (8, 11)
+    assert normalized.original_span(3, 4) == (6, 8)
+    assert normalized.original[slice(*normalized.original_span(12, 13))] == "か゛"
+    assert pyknp.utils.Normalizer(fullwidth=False)("ＡＢＣ  ｱ").text == "ABC ア"
+    # 改行は対応する位置ごと取り除く
+    normalized = pyknp.utils.Normalizer(collapse_whitespace=False)("ａ\nｂ")
+    assert normalized.text == "ａｂ"
+    assert normalized.spans == [(0, 1), (2, 3)]
+
+
+def test_knp_normalizer():
+    cache = pyknp.utils.AnalysisCache()
+    knp = pyknp.KNP(cache=cache, normalizer=True)
+    result = knp.parse("ﾃｽﾄ abc")
+    assert result.normalized.text == "テスト　ａｂｃ"
+    # 幅や空白だけが異なる入力は記憶している結果を使う
+    hits = cache.hits
+    again = knp.parse("テスト  ａｂｃ ")
+    assert cache.hits == hits + 2
+    assert again.spec() == result.spec()
+    assert again.normalized.original == "テスト  ａｂｃ "
+    mrph = again.mrph_list()[4]
+    start = sum(len(m.midasi) for m in again.mrph_list()[:4])
+    assert again.normalized.original_span(start, start + len(mrph.midasi)) == (5, 6)
+    assert [r.normalized.text for r in knp.parse_batch(["ｱ", "ｲ"])] == ["ア", "イ"]
+    assert [r.normalized.text for r in pyknp.Juman(normalizer=True).analysis_batch(["ｱ"])] == ["ア"]
+    result = pyknp.Juman(normalizer=pyknp.utils.Normalizer(collapse_whitespace=False)).analysis("ａ\nｂ")
+    assert result.normalized.text == "".join(m.midasi for m in result.mrph_list()) == "ａｂ"
+
+
+def test_morpheme_cache():
+    spec = "構文 こうぶん 構文 名詞 6 普通名詞 1 * 0 * 0 NIL <漢字><かな漢字><自立><←複合><名詞相当語>"
+    mrph1 = pyknp.Morpheme(spec, 1)
+    mrph2 = pyknp.Morpheme(spec, 2)
+    assert (mrph2.mrph_id, mrph2.spec()) == (2, mrph1.spec())
+    # 同じ行から作った形態素でも features は共有しない
+    assert mrph2.features == mrph1.features and mrph2.features is not mrph1.features
+    mrph2.features["追加"] = True
+    assert "追加" not in pyknp.Morpheme(spec, 3).features
+
+    lattice = "-\t{}\t{}\t{}\t{}\t貰った\t貰う/もらう\tもらった\tもらう\t動詞\t2\t*\t0\t子音動詞ワ行\t12\tタ形\t10\t" \
+              "付属動詞候補（タ系）|ランク:1;2"
+    mrph1 = pyknp.Morpheme(lattice.format(36, "2", 2, 4), 36, pyknp.JUMAN_FORMAT.LATTICE_ALL)
+    mrph2 = pyknp.Morpheme(lattice.format(40, "3;4", 5, 7), 40, pyknp.JUMAN_FORMAT.LATTICE_ALL)
+    assert (mrph2.mrph_id, mrph2.prev_mrph_id, mrph2.span) == (40, [3, 4], (5, 7))
+    assert (mrph2.midasi, mrph2.ranks, mrph2.features) == (mrph1.midasi, {1, 2}, mrph1.features)
+    assert mrph2.new_spec() == lattice.format(40, "3;4", 5, 7) + "\n"
+    mrph2.features["ランク"].append("9")
+    assert mrph1.features["ランク"] == ["1", "2"]
+    assert pyknp.Morpheme(lattice.format(41, "2", 8, 10), 41, pyknp.JUMAN_FORMAT.LATTICE_ALL).features["ランク"] == \
+        ["1", "2"]
+
+
+def test_analyzer_coalesce_fork():
+    echo = "import sys, time\nfor line in sys.stdin:\n    time.sleep(1)\n    print(line.strip() + '\\nEOS', flush=True)"
+    analyzer = pyknp.utils.Analyzer(backend="subprocess", multithreading=True, command=[sys.executable, "-c", echo],
+                                    coalesce=True)
+    thread = threading.Thread(target=analyzer.query, args=("a", "EOS"))
+    thread.start()
+    time.sleep(0.3)
+    # 親で解析中の要求は子プロセスに引き継がれないため、子プロセスでは解析し直す
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = analyzer.query("a", "EOS", deadline=time.monotonic() + 5).startswith("a")
+        except BaseException:
+            ok = False
+        os._exit(0 if ok else 1)
+    thread.join()
+    assert os.waitpid(pid, 0)[1] == 0
+
+
+def test_analyzer_coalesce_priority():
+    analyzer = pyknp.utils.Analyzer(backend="subprocess", command=["true"], coalesce=True)
+    calls = []
+    release = threading.Event()
+
+    def _query_once(input_str, pattern, priority, deadline):
+        calls.append((input_str, priority))
+        if priority == "batch" or deadline is not None:
+            release.wait(5)
+        if deadline is not None:
+            raise pyknp.utils.OverloadedError("The deadline has passed")
+        return input_str
+
+    analyzer._query_once = _query_once
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        batch = executor.submit(analyzer.query, "a", "EOS", priority="batch")
+        time.sleep(0.1)
+        # 優先度の低い解析の結果は待たずに解析する
+        assert analyzer.query("a", "EOS") == "a"
+        release.set()
+        assert batch.result() == "a"
+    assert calls == [("a", "batch"), ("a", "interactive")]
+    # 先に依頼した呼び出し元の締め切りで断られた場合は、締め切りのない要求は自分で解析し直す
+    del calls[:]
+    release.clear()
+    with concurrent.futures.ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(analyzer.query, "b", "EOS", deadline=time.monotonic() + 60)
+        time.sleep(0.1)
+        follower = executor.submit(analyzer.query, "b", "EOS")
+        time.sleep(0.1)
+        release.set()
+        with pytest.raises(pyknp.utils.OverloadedError):
+            leader.result()
+        assert follower.result() == "b"
+    assert calls == [("b", "interactive"), ("b", "interactive")]
+
+
+def test_juman_unknown_priority():
+    # どのバックエンドでも同じように未知の優先度を拒否する
+    juman = pyknp.Juman()
+    with pytest.raises(Exception, match="Unknown priority"):
+        juman.analysis("あ", priority="intractive")
+    with pytest.raises(Exception, match="Unknown priority"):
+        juman.analysis_batch(["あ"], priority="intractive")
+
+
+def test_juman_overload():
+    juman = pyknp.Juman(workers=1, max_queue=0)
+    assert juman.analysis("今日は晴れ")
+    # 唯一のプロセスが塞がっている間は待たずに断る
+    index = juman.analyzer._acquire()
+    try:
+        with pytest.raises(pyknp.utils.OverloadedError):
+            juman.analysis("今日は晴れ")
+    finally:
+        juman.analyzer._release(index)
+    with pytest.raises(pyknp.utils.OverloadedError):
+        juman.analysis("今日は晴れ", deadline=time.monotonic() - 1)
+    assert juman.analysis("今日は晴れ", deadline=time.monotonic() + 60)
+
+
+def test_juman_overload_batch():
+    juman = pyknp.Juman(workers=2, max_queue=3)
+    juman.analyzer.batch_size = 2
+    stop = threading.Event()
+
+    def interactive():
+        while not stop.is_set():
+            try:
+                juman.analysis("今日は晴れ")
+            except pyknp.utils.OverloadedError:
+                pass
+
+    threads = [threading.Thread(target=interactive) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    try:
+        # 一度受け付けたバッチは、途中で待ち行列が埋まっても最後まで解析する
+        for _ in range(5):
+            results = juman.analysis_batch(["今日は晴れ"] * 40, priority='batch')
+            assert len(results) == 40
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+
+def test_knp_fork(knp_workers):
+    _task(knp_workers)
+    pid = os.fork()
+    if pid == 0:
+        # 子プロセスでは親のKNP/JUMANを使わずに起動し直す
+        try:
+            knp_workers.prewarm_after_fork()
+            _task(knp_workers)
+        except BaseException:
+            os._exit(1)
+        os._exit(0)
+    _, status = os.waitpid(pid, 0)
+    assert status == 0
+    assert all(process is None or process.is_alive() for process in knp_workers.analyzer._processes)
+    _task(knp_workers)
+
+
+def test_juman_recycle():
+    juman = pyknp.Juman(workers=1, max_requests=2, memory_limit=1 << 40)
+    juman.analysis("今日は晴れ")
+    process = juman.analyzer._processes[0]
+    juman.analysis("今日は晴れ")
+    # 上限に達したプロセスの代わりはバックグラウンドで起動される
+    for _ in range(50):
+        if juman.analyzer._processes[0] is not process:
+            break
+        time.sleep(0.1)
+    assert juman.analyzer._processes[0] is not process
+    assert juman.analysis("今日は晴れ")
+
+
+def test_analyzer_discard_after_recycle():
+    from pyknp.utils.analyzer import AnalyzerPool
+    echo = "import sys, time\nfor line in sys.stdin:\n    time.sleep(60 if 'SLOW' in line else 0)\n" \
+           "    print(line.strip() + '\\nEOS', flush=True)"
+    pool = AnalyzerPool([sys.executable, "-c", echo], 1, timeout=1, max_requests=1)
+    spawn = pool._spawn
+
+    def _spawn():
+        if threading.current_thread() is not threading.main_thread():
+            time.sleep(0.5)
+        return spawn()
+
+    pool._spawn = _spawn
+    pool.query("a", pattern="EOS")
+    old = pool._processes[0]
+    # 上限に達したプロセスで解析している間に代わりと入れ替わっても、終了させるのはタイムアウトしたプロセスの方
+    with pytest.raises(pyknp.utils.AnalysisTimeoutError):
+        pool.query("SLOW", pattern="EOS")
+    new = pool._processes[0]
+    assert new is not None and new is not old and new.is_alive()
+    assert old.process.wait(timeout=5) is not None
+    assert pool.query("b", pattern="EOS").startswith("b")
+
+
+def test_analyzer_restart_wait():
+    from pyknp.utils.analyzer import AnalyzerPool
+    echo = "import sys\nfor line in sys.stdin:\n    if 'DIE' in line:\n        sys.exit(1)\n" \
+           "    print(line.strip() + '\\nEOS', flush=True)"
+    pool = AnalyzerPool([sys.executable, "-c", echo], 1)
+    spawn = pool._spawn
+    spawned = []
+
+    def _spawn():
+        spawned.append(threading.current_thread() is threading.main_thread())
+        if not spawned[-1]:
+            time.sleep(0.5)
+        return spawn()
+
+    pool._spawn = _spawn
+    pool.query("a", pattern="EOS")
+    with pytest.raises(Exception):
+        pool.query("DIE", pattern="EOS")
+    # 次の要求はバックグラウンドで起動中の代わりを待ち、重ねて起動しない
+    assert pool.query("c", pattern="EOS").startswith("c")
+    assert spawned == [True, False]
+
+
+def test_juman_affinity():
+    import resource
+    juman = pyknp.Juman(workers=2, cpus=[0], nice=5, memory_limit=1 << 40)
+    juman.analysis_batch(["今日は晴れ"] * 4)
+    for process in juman.analyzer._processes:
+        if process is not None:
+            assert os.sched_getaffinity(process.process.pid) == {0}
+            assert os.getpriority(os.PRIO_PROCESS, process.process.pid) >= 5
+            assert resource.prlimit(process.process.pid, resource.RLIMIT_AS) == (1 << 40, 1 << 40)
+
+
+def test_analyzer_quarantine():
+    from pyknp.utils.analyzer import AnalyzerPool, Quarantine
+    echo = "import sys, time\nfor line in sys.stdin:\n    %s\n    print(line.strip() + '\\nEOS', flush=True)"
+    quarantine = Quarantine()
+    fallback = pyknp.utils.Analyzer(backend="subprocess", command=[sys.executable, "-c", echo % "pass"])
+    pool = AnalyzerPool([sys.executable, "-c", echo % "time.sleep(60 if 'SLOW' in line else 0)"], 2, timeout=0.5,
+                        quarantine=quarantine, fallback=fallback)
+    start = time.monotonic()
+    with pytest.raises(pyknp.utils.AnalysisTimeoutError):
+        pool.query("SLOW", pattern=r"^EOS$")
+    assert "SLOW" in quarantine
+    # 記録された入力は代わりの解析器で解析し、他の入力はそのまま解析する
+    assert pool.query("SLOW", pattern=r"^EOS$") == "SLOW\n"
+    assert pool.query_batch(["a", "SLOW", "b"], pattern=r"^EOS$") == ["a\n", "SLOW\n", "b\n"]
+    assert time.monotonic() - start < 10
+
+
+def test_analyzer_batch_error():
+    from pyknp.utils.analyzer import AnalyzerPool
+    echo = "import sys, time\nfor line in sys.stdin:\n    time.sleep(60 if 'SLOW' in line else 0.02)\n" \
+           "    print(line.strip() + '\\nEOS', flush=True)"
+    pool = AnalyzerPool([sys.executable, "-c", echo], 2, timeout=0.5)
+    pool.prewarm_after_fork()
+    start = time.monotonic()
+    # 1つの入力が失敗したら、他のサブプロセスも残りの入力を解析せずに打ち切る
+    with pytest.raises(pyknp.utils.AnalysisTimeoutError):
+        pool.query_batch(["SLOW"] + ["a"] * 399, pattern=r"^EOS$")
+    assert time.monotonic() - start < 3
+
+
+def test_knp_document(knp):
+    texts = ["今日はいい天気だった", "赤い花が咲いた。"]
+    blists = knp.parse_document(texts, "doc")
+    assert [blist.sid for blist in blists] == ["doc-1", "doc-2"]
+    assert texts == ["".join(b.midasi for b in blist) for blist in blists]
+
+
+def test_knp_daemon(tmp_path):
+    from pyknp.utils.daemon import DaemonServer
+    path = str(tmp_path / "pyknp.sock")
+    server = DaemonServer(path, [["jumanpp"], ["knp", "-tab"]], workers=2, mode=0o660)
+    # 接続を受け付ける前に権限を設定している
+    assert os.stat(path).st_mode & 0o777 == 0o660
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        _task(pyknp.KNP(daemon=path))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_juman_daemon_timeout(tmp_path):
+    import socket
+    # 接続は受け付けるが応答しない pyknp-server
+    path = str(tmp_path / "pyknp.sock")
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    listener.bind(path)
+    listener.listen(4)
+    try:
+        juman = pyknp.Juman(daemon=path, timeout=0.2)
+        client = juman.analyzer._backend()
+        client.grace = 0
+        start = time.monotonic()
+        with pytest.raises(pyknp.utils.AnalysisTimeoutError):
+            juman.analysis("今日は晴れ")
+        with pytest.raises(pyknp.utils.OverloadedError):
+            juman.analysis("今日は晴れ", deadline=time.monotonic() + 0.1)
+        assert time.monotonic() - start < 5
+        assert client._local.sock is None
+    finally:
+        listener.close()
+
+
+def test_juman_server_connections(tmp_path):
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        # juman -S と同じ手順で応答し、1文ごとに接続を切る
+        def handle(self):
+            self.wfile.write(b"200 Running JUMAN Server\n")
+            self.rfile.readline()
+            self.wfile.write(b"200 OK\n")
+            line = self.rfile.readline().decode("utf-8").strip()
+            out = "".join("%s %s %s 名詞 6 普通名詞 1 * 0 * 0 NIL\n" % (c, c, c) for c in line) + "EOS\n"
+            self.wfile.write(out.encode("utf-8"))
+
+    path = str(tmp_path / "juman.sock")
+    server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+        juman = pyknp.Juman(server=path, connections=2)
+        texts = ["今日はいい天気だった", "明日は雨", "晴れ"] * 2
+        with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+            results = list(executor.map(juman.analysis, texts))
+        assert texts == ["".join(m.midasi for m in mlist) for mlist in results]
+    finally:
+        server.shutdown()
+        server.server_close()